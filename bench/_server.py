@@ -0,0 +1,36 @@
+"""基准测试共用：把 g-server.py 复制到临时目录后导入，数据库、快照等文件都写在临时目录中"""
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def copy_server(workdir=None, source=None):
+    """source 可以指向其他版本的 g-server.py，用于和当前版本对比"""
+    workdir = workdir or tempfile.mkdtemp(prefix="g-server-bench-")
+    shutil.copy(source or os.path.join(REPO_DIR, "g-server.py"),
+                os.path.join(workdir, "g-server.py"))
+    for name in ("templates", "static"):
+        target = os.path.join(workdir, name)
+        if not os.path.exists(target):
+            os.symlink(os.path.join(REPO_DIR, name), target)
+    return workdir
+
+
+def load_server(name="gserver", workdir=None, source=None):
+    """复制并导入一份 g-server.py，返回模块对象"""
+    return import_server(copy_server(workdir, source), name)
+
+
+def import_server(workdir, name="gserver"):
+    """导入 workdir 中已有的 g-server.py 并停掉定时任务"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(workdir, "g-server.py"))
+    module = importlib.util.module_from_spec(spec)
+    # 先注册到 sys.modules，Flask 才能把 root_path 定位到临时目录
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    module.scheduler.shutdown(wait=False)
+    return module
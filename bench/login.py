@@ -0,0 +1,112 @@
+"""登录吞吐：本地桩服务模拟极验校验接口（固定 20ms 延迟），同时测量登录期间其他请求的延迟
+
+用法：python bench/login.py [g-server.py 路径]
+比较改动前后：git show <commit>:g-server.py > /tmp/old.py && python bench/login.py /tmp/old.py
+"""
+import base64
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from werkzeug.serving import make_server
+
+from _server import load_server
+
+CAPTCHA_LATENCY = 0.02
+LOGINS = 64
+CLIENTS = 16
+
+
+class StubCaptchaHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(CAPTCHA_LATENCY)
+        body = b'{"result":"success"}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_thread(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    stub = ThreadingHTTPServer(('127.0.0.1', 0), StubCaptchaHandler)
+    start_thread(stub.serve_forever)
+    stub_url = f"http://127.0.0.1:{stub.server_port}/validate"
+
+    server = load_server(source=sys.argv[1] if len(sys.argv) > 1 else None)
+    server.geetest_config = {"captchaId": "id", "captchaKey": "key"}
+    if hasattr(server, 'GEETEST_VALIDATE_URL'):
+        server.GEETEST_VALIDATE_URL = stub_url
+    else:
+        # 旧版本直接用 requests.post 请求固定地址
+        real_post = server.requests.post
+        server.requests.post = lambda url, **kwargs: real_post(
+            stub_url + '?' + url.split('?', 1)[1], **kwargs)
+    with server.app.app_context():
+        # 旧版本只在 __main__ 中建表
+        server.db.create_all()
+        user = server.User(username='bench')
+        user.set_password('password')
+        server.db.session.add(user)
+        server.db.session.commit()
+
+    http_server = make_server('127.0.0.1', 0, server.app, threaded=True)
+    start_thread(http_server.serve_forever)
+    base_url = f"http://127.0.0.1:{http_server.server_port}"
+
+    public_key = serialization.load_pem_public_key(
+        requests.get(base_url + '/get-public-key').content)
+    encrypted = base64.b64encode(public_key.encrypt(b'password', padding.PKCS1v15())).decode()
+    body = json.dumps({"username": "bench", "password": encrypted, "validate": {
+        "lot_number": "x", "captcha_output": "", "pass_token": "", "gen_time": ""}})
+
+    def login(_=None):
+        # 用 Session 发请求，不经过上面替换掉的 requests.post
+        response = requests.Session().post(base_url + '/login', data=body,
+                                 headers={'Content-Type': 'application/json'})
+        return response.status_code
+
+    stop = threading.Event()
+    latencies = []
+
+    def probe():
+        session = requests.Session()
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.get(base_url + '/get-public-key')
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    login()
+    probe_thread = start_thread(probe)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(CLIENTS) as executor:
+        statuses = list(executor.map(login, range(LOGINS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    probe_thread.join()
+
+    latencies.sort()
+    print(f"{LOGINS} logins / {CLIENTS} clients in {elapsed:.2f}s = {LOGINS / elapsed:.1f}/s, "
+          f"statuses={dict(Counter(statuses))}, probe p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms max={latencies[-1] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""冷启动时 200 个并发 getnotice 请求只应重建一次快照
+
+用法：python bench/notice_rebuild.py [并发数]
+"""
+import sys
+import threading
+import time
+
+from _server import load_server
+
+CONCURRENCY = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+
+def main():
+    server = load_server()
+    # 不访问外部接口：刷新任务直接跳过
+    server.start_background_refresh = lambda: False
+    with server.app.app_context():
+        server.update_request_log()
+        announcements = [{
+            "title": f"「活动{i}」祈愿",
+            "start_time": "2025-01-01 00:00:00",
+            "end_time": "2099-01-01 00:00:00",
+            "bannerImage": f"https://example.com/{i}.png",
+            "event_type": "gacha",
+        } for i in range(100)]
+        server.process_and_save_announcements({"ys": announcements})
+
+    # 放慢快照生成，让所有请求都落在重建窗口内
+    build_notice_events = server.build_notice_events
+
+    def slow_build_notice_events(now):
+        time.sleep(0.05)
+        return build_notice_events(now)
+    server.build_notice_events = slow_build_notice_events
+
+    client = server.app.test_client()
+    barrier = threading.Barrier(CONCURRENCY)
+    statuses = []
+    etags = set()
+    results_lock = threading.Lock()
+
+    def request_notice():
+        barrier.wait()
+        response = client.get('/game-events/getnotice')
+        with results_lock:
+            statuses.append(response.status_code)
+            etags.add(response.headers.get('ETag'))
+
+    threads = [threading.Thread(target=request_notice) for _ in range(CONCURRENCY)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    stats = dict(server.notice_snapshot_stats)
+    print(f"{CONCURRENCY} cold requests in {elapsed:.3f}s, "
+          f"statuses={sorted(set(statuses))}, etags={len(etags)}, stats={stats}")
+    assert statuses == [200] * CONCURRENCY, statuses
+    assert len(etags) == 1, etags
+    assert stats["rebuilds"] == 1, stats
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""冷启动耗时：每次在新的解释器中导入一份 g-server.py
+
+首次启动使用空目录（需要建库、生成 RSA 密钥），重启复用同一目录。
+用法：python bench/startup.py [次数] [g-server.py 路径]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from _server import copy_server
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+SOURCE = sys.argv[2] if len(sys.argv) > 2 else None
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ("PIL.Image", "bs4", "cryptography.hazmat.primitives.asymmetric.rsa")
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from _server import import_server
+import_server(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed,
+                  "loaded": [name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+
+def run_once(workdir):
+    output = subprocess.run([sys.executable, "-c", CHILD, workdir, *HEAVY_MODULES],
+                            cwd=BENCH_DIR, env=dict(os.environ, PYTHONPATH=BENCH_DIR),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(label, results):
+    seconds = [result["seconds"] for result in results]
+    print(f"{label}: median {statistics.median(seconds) * 1000:.0f}ms, "
+          f"min {min(seconds) * 1000:.0f}ms, max {max(seconds) * 1000:.0f}ms, "
+          f"heavy modules loaded: {results[-1]['loaded']}")
+
+
+def main():
+    first = [run_once(copy_server(source=SOURCE)) for _ in range(RUNS)]
+    workdir = copy_server(source=SOURCE)
+    run_once(workdir)
+    restart = [run_once(workdir) for _ in range(RUNS)]
+    report("first start", first)
+    report("restart", restart)
+
+
+if __name__ == "__main__":
+    main()
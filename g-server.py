@@ -10,20 +10,110 @@ import string
 import base64
 import hmac
 import hashlib
+import gzip
+import zlib
+import html
+import time
+import threading
+import atexit
+import signal
+import importlib
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, render_template, jsonify, make_response, send_file, send_from_directory, request, redirect
+from collections import OrderedDict
+from flask import Flask, render_template, jsonify, make_response, send_from_directory, request, redirect
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_socketio import SocketIO, emit
 from flask_socketio import join_room, leave_room
-from PIL import Image, ImageDraw, ImageFont
+from socketio import KombuManager
 from apscheduler.schedulers.background import BackgroundScheduler
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import serialization, hashes
 from werkzeug.security import generate_password_hash, check_password_hash
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
+# userid -> 该用户的 sid 集合，sid -> userid 的反向索引用于断开连接时直接定位
 user_connections = {}
+connection_users = {}
+connections_lock = threading.Lock()
+# 登录 token -> (userid, username, 缓存时间) 的 LRU 缓存
+# 任一进程吊销 token 时追加写共享的吊销文件，其他进程命中缓存前比较文件大小，变化即清空缓存
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_TTL = 300
+token_cache = OrderedDict()
+token_cache_lock = threading.Lock()
+token_cache_generation = None
+token_cache_stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0,
+                     "invalidations": 0, "revocation_clears": 0}
+# 设置写入缓冲：连续修改停止 SETTINGS_FLUSH_DELAY 秒后合并写库，最长不超过 SETTINGS_FLUSH_MAX_DELAY 秒
+# 由每个进程一个常驻的写入线程负责，它在 condition 上等待到期时间
+SETTINGS_FLUSH_DELAY = 2
+SETTINGS_FLUSH_MAX_DELAY = 10
+pending_settings = {}
+pending_settings_lock = threading.Lock()
+settings_flush_condition = threading.Condition(pending_settings_lock)
+settings_flush_due = None
+settings_flush_deadline = None
+settings_flusher_pid = None
+settings_flush_stats = {"buffered": 0, "flushes": 0, "rows": 0}
+# 公告抓取：并发线程数、单个游戏的截止时间和整次刷新的截止时间（秒）
+FETCH_MAX_WORKERS = 4
+FETCH_GAME_DEADLINE = 60
+FETCH_TOTAL_DEADLINE = 90
+# 解析公告正文的进程数，0 表示在抓取线程中直接解析
+PARSE_PROCESSES = int(os.environ.get('PARSE_PROCESSES', 0))
+# 鸣潮活动详情：并发下载数和单条失败后的重试次数
+WW_DETAIL_WORKERS = 8
+WW_DETAIL_RETRIES = 2
+fetch_stats = {}
+http_cache_stats = {}
+parse_cache = None
+parse_cache_lock = threading.Lock()
+parse_cache_stats = {}
+extract_stats = {}
+parse_pool = None
+parse_pool_pid = None
+parse_pool_lock = threading.Lock()
+refresh_lock = threading.Lock()
+# 多进程部署时只有持有该文件锁的进程执行定时刷新
+SCHEDULER_HEARTBEAT_SECONDS = 30
+scheduler_lock_file = None
+scheduler_lock_pid = None
+# 极验二次校验：连接池复用连接，(连接超时, 读取超时) 秒
+GEETEST_VALIDATE_URL = "http://gcaptcha4.geetest.com/validate"
+GEETEST_TIMEOUT = (2, 3)
+geetest_session = None
+geetest_session_lock = threading.Lock()
+# 密码校验（scrypt）线程数，以及同时排队的上限和等待时间（秒），超出时直接拒绝
+PASSWORD_HASH_WORKERS = 4
+PASSWORD_HASH_QUEUE = 16
+PASSWORD_HASH_QUEUE_TIMEOUT = 5
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                            thread_name_prefix='password-hash')
+password_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+# RSA 密钥超过这个天数后由调度进程轮换
+RSA_KEY_MAX_AGE_DAYS = 30
+rsa_keys = None
+rsa_keys_lock = threading.Lock()
+# 动态图标：日期 -> (PNG, ETag)
+favicon_font = None
+favicon_cache = {}
+favicon_lock = threading.Lock()
+# 活动横幅本地缓存，开启后 getnotice 额外返回本地原图和缩略图地址
+BANNER_CACHE_ENABLED = os.environ.get('BANNER_CACHE', '0') == '1'
+BANNER_THUMB_WIDTH = 320
+BANNER_MAX_BYTES = 10 * 1024 * 1024
+# 不再被引用的横幅文件保留的天数，避免刚切换快照的进程引用到已删除的文件
+BANNER_RETENTION_DAYS = 7
+banner_cache_stats = {}
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -36,10 +126,68 @@ logging.getLogger('werkzeug').setLevel(logging.ERROR)
 base_dir = app.root_path
 # base_dir = os.path.abspath(os.path.dirname(__file__))
 db_path = os.path.join(base_dir, 'events.sqlite3')
+http_cache_dir = os.path.join(base_dir, 'http-cache')
+parse_cache_path = os.path.join(base_dir, 'parse-cache.json')
+notice_snapshot_path = os.path.join(base_dir, 'getnotice.snapshot')
+scheduler_lock_path = os.path.join(base_dir, 'scheduler.lock')
+migrate_lock_path = os.path.join(base_dir, 'migrate.lock')
+token_revocation_path = os.path.join(base_dir, 'token-revocations')
+# 登录用的 RSA 私钥，所有 worker 共用；轮换后上一代密钥保留在 previous 文件中用于解密
+rsa_private_key_path = os.path.join(base_dir, 'rsa-private.pem')
+rsa_previous_key_path = os.path.join(base_dir, 'rsa-private.previous.pem')
+favicon_font_path = os.path.join(base_dir, '凤凰点阵体 12px.ttf')
+banner_cache_dir = os.path.join(base_dir, 'banner-cache')
+banner_index_path = os.path.join(banner_cache_dir, 'index.json')
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
-socketio = SocketIO(app, cors_allowed_origins='*')
+# Socket.IO 消息队列，多个 worker 进程通过它互相转发房间消息，例如 redis://127.0.0.1:6379/0
+# 本机测试可以用 kombu 的 memory://（单进程）或 filesystem://（多进程，文件放在 socketio-queue 目录）
+# redis:// 需要另外安装 redis 包，其余地址都经由 kombu（已在 requirements.txt 中）
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')
+socketio_queue_dir = os.path.join(base_dir, 'socketio-queue')
+# 消息队列地址前缀 -> (需要的模块, pip 包名)，与 Flask-SocketIO 选择队列实现的规则一致
+SOCKETIO_QUEUE_PACKAGES = (
+    (('redis://', 'rediss://'), 'redis', 'redis'),
+    (('kafka://',), 'kafka', 'kafka-python'),
+    (('zmq',), 'zmq', 'pyzmq'),
+)
+
+
+def check_socketio_queue_package(url):
+    """缺少消息队列依赖时启动即退出，而不是等到第一次广播才报错"""
+    module, package = 'kombu', 'kombu'
+    for prefixes, queue_module, queue_package in SOCKETIO_QUEUE_PACKAGES:
+        if url.startswith(prefixes):
+            module, package = queue_module, queue_package
+            break
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        print(f"Error: SOCKETIO_MESSAGE_QUEUE={url} requires the {package} package "
+              f"(pip install {package})")
+        raise SystemExit(1)
+
+
+def create_socketio():
+    if not SOCKETIO_MESSAGE_QUEUE:
+        return SocketIO(app, cors_allowed_origins='*')
+    check_socketio_queue_package(SOCKETIO_MESSAGE_QUEUE)
+    if SOCKETIO_MESSAGE_QUEUE.startswith('filesystem://'):
+        # filesystem 传输需要指定收发目录，Flask-SocketIO 不会替我们传这些参数
+        os.makedirs(socketio_queue_dir, exist_ok=True)
+        transport_options = {
+            'data_folder_in': socketio_queue_dir,
+            'data_folder_out': socketio_queue_dir,
+            'control_folder': socketio_queue_dir,
+        }
+        manager = KombuManager(SOCKETIO_MESSAGE_QUEUE, channel='flask-socketio',
+                               connection_options={'transport_options': transport_options})
+        return SocketIO(app, cors_allowed_origins='*', client_manager=manager)
+    return SocketIO(app, cors_allowed_origins='*', message_queue=SOCKETIO_MESSAGE_QUEUE)
+
+
+socketio = create_socketio()
 req_headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8",
@@ -50,6 +198,16 @@ req_headers = {
 }
 
 
+def create_session():
+    session = requests.Session()
+    # 连接池需容纳所有并发请求，否则多出来的连接用完即关，无法复用
+    adapter = HTTPAdapter(
+        pool_connections=FETCH_MAX_WORKERS, pool_maxsize=WW_DETAIL_WORKERS + FETCH_MAX_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 def cache_control(cache_header):
     def decorator(f):
         @wraps(f)
@@ -75,27 +233,191 @@ def static_file(path):
     return response
 
 
-@socketio.on('connect')
-def handle_connect():
-    token = request.args.get('token')
+def read_token_revocation_generation():
+    """吊销文件只追加不截断，(inode, 大小) 变化即说明有进程吊销过 token"""
+    try:
+        st = os.stat(token_revocation_path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size
+
+
+def bump_token_revocation_generation():
+    fd = os.open(token_revocation_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, b"\n")
+    finally:
+        os.close(fd)
+
+
+def authenticate_token(token):
+    """返回 token 对应的 (userid, username)，token 无效时返回 None"""
+    global token_cache_generation
     if not token:
-        return False
+        return None
+    now = time.monotonic()
+    generation = read_token_revocation_generation()
+    with token_cache_lock:
+        if generation != token_cache_generation:
+            if token_cache:
+                token_cache.clear()
+                token_cache_stats["revocation_clears"] += 1
+            token_cache_generation = generation
+        entry = token_cache.get(token)
+        if entry is not None:
+            if now - entry[2] < TOKEN_CACHE_TTL:
+                token_cache.move_to_end(token)
+                token_cache_stats["hits"] += 1
+                return entry[0], entry[1]
+            del token_cache[token]
+            token_cache_stats["expired"] += 1
+        token_cache_stats["misses"] += 1
+
+    row = db.session.query(UserLoginToken.userid, User.username).join(
+        User, User.userid == UserLoginToken.userid).filter(
+        UserLoginToken.token == token).first()
+    if row is None:
+        return None
+
+    with token_cache_lock:
+        # 查询期间有 token 被吊销时不写缓存，查到的可能是吊销前的结果
+        if token_cache_generation != generation:
+            return row.userid, row.username
+        token_cache[token] = (row.userid, row.username, now)
+        token_cache.move_to_end(token)
+        while len(token_cache) > TOKEN_CACHE_SIZE:
+            token_cache.popitem(last=False)
+            token_cache_stats["evictions"] += 1
+    return row.userid, row.username
+
+
+def invalidate_token(token):
+    """在删除 token 的事务提交之后调用，同时通知其他进程清空缓存"""
+    try:
+        bump_token_revocation_generation()
+    except OSError as e:
+        print(f"Error bumping token revocation generation: {repr(e)}")
+    with token_cache_lock:
+        if token_cache.pop(token, None) is not None:
+            token_cache_stats["invalidations"] += 1
+
+
+def get_token_cache_stats():
+    with token_cache_lock:
+        stats = dict(token_cache_stats, size=len(token_cache))
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+    return stats
+
+
+def buffer_user_settings(userid, settings):
+    """记录用户最新的设置，稍后和其他用户的修改一起写入数据库"""
+    global settings_flush_due, settings_flush_deadline
+    with settings_flush_condition:
+        pending_settings[userid] = settings
+        settings_flush_stats["buffered"] += 1
+        now = time.monotonic()
+        if settings_flush_deadline is None:
+            settings_flush_deadline = now + SETTINGS_FLUSH_MAX_DELAY
+        settings_flush_due = min(now + SETTINGS_FLUSH_DELAY, settings_flush_deadline)
+        start_settings_flusher()
+        settings_flush_condition.notify()
+
+
+def start_settings_flusher():
+    """调用方需持有 pending_settings_lock；fork 出的子进程没有父进程的线程，按 pid 判断是否需要重新启动"""
+    global settings_flusher_pid
+    if settings_flusher_pid == os.getpid():
+        return
+    settings_flusher_pid = os.getpid()
+    threading.Thread(target=run_settings_flusher, name='settings-flusher', daemon=True).start()
+
+
+def run_settings_flusher():
+    while True:
+        with settings_flush_condition:
+            while True:
+                now = time.monotonic()
+                if settings_flush_due is not None and settings_flush_due <= now:
+                    break
+                settings_flush_condition.wait(
+                    None if settings_flush_due is None else settings_flush_due - now)
+        flush_pending_settings()
 
-    login_token = UserLoginToken.query.filter_by(token=token).first()
-    if not login_token:
-        return False
 
-    userid = login_token.userid
-    user = User.query.filter_by(userid=userid).first()
-    if not user:
-        return False
+def get_pending_settings(userid):
+    with pending_settings_lock:
+        return pending_settings.get(userid)
+
+
+def discard_pending_settings(userid):
+    with pending_settings_lock:
+        pending_settings.pop(userid, None)
+
 
-    username = user.username
+def flush_pending_settings(userids=None):
+    """在一个事务里写入缓冲的设置；userids 为 None 时写入全部"""
+    global settings_flush_due, settings_flush_deadline
+    with pending_settings_lock:
+        if userids is None:
+            batch = dict(pending_settings)
+            pending_settings.clear()
+            settings_flush_due = None
+            settings_flush_deadline = None
+        else:
+            batch = {userid: pending_settings.pop(userid)
+                     for userid in userids if userid in pending_settings}
+    if not batch:
+        return 0
+
+    rows = [{"userid": userid, "settings": json.dumps(settings)}
+            for userid, settings in batch.items()]
+    stmt = sqlite_insert(UserSettings)
+    stmt = stmt.on_conflict_do_update(index_elements=[UserSettings.userid],
+                                      set_={"settings": stmt.excluded.settings})
+    try:
+        with app.app_context():
+            db.session.execute(stmt, rows)
+            db.session.commit()
+    except Exception as e:
+        print(f"Error flushing user settings: {e}")
+        with app.app_context():
+            db.session.rollback()
+        # 写入失败时放回缓冲，但不覆盖期间产生的更新，稍后由写入线程重试
+        with settings_flush_condition:
+            for userid, settings in batch.items():
+                pending_settings.setdefault(userid, settings)
+            if settings_flush_due is None:
+                settings_flush_due = time.monotonic() + SETTINGS_FLUSH_DELAY
+                settings_flush_condition.notify()
+        return 0
+    with pending_settings_lock:
+        settings_flush_stats["flushes"] += 1
+        settings_flush_stats["rows"] += len(rows)
+    return len(rows)
 
-    if userid not in user_connections:
-        user_connections[userid] = []
 
-    user_connections[userid].append(request.sid)
+atexit.register(flush_pending_settings)
+
+
+def handle_shutdown_signal(signum, frame):
+    """docker stop 发送的 SIGTERM 默认不会执行 atexit，先写入缓冲的设置再退出"""
+    flush_pending_settings()
+    raise SystemExit(0)
+
+
+@socketio.on('connect')
+def handle_connect():
+    token = request.args.get('token')
+    auth = authenticate_token(token)
+    if not auth:
+        return False
+
+    userid, username = auth
+
+    with connections_lock:
+        user_connections.setdefault(userid, set()).add(request.sid)
+        connection_users[request.sid] = userid
     join_room(str(userid))
     # print(f"User {userid} connected with session ID {request.sid}")
 
@@ -104,40 +426,38 @@ def handle_connect():
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    for userid, connections in user_connections.items():
-        if request.sid in connections:
-            connections.remove(request.sid)
-            leave_room(str(userid))
-            # print(f"User {userid} disconnected with session ID {request.sid}")
-            break
+    with connections_lock:
+        userid = connection_users.pop(request.sid, None)
+        if userid is None:
+            return
+        connections = user_connections.get(userid)
+        if connections is not None:
+            connections.discard(request.sid)
+            if not connections:
+                del user_connections[userid]
+    leave_room(str(userid))
+    flush_pending_settings([userid])
+    # print(f"User {userid} disconnected with session ID {request.sid}")
 
 
 @socketio.on('settings_updated')
 def handle_update_settings(data):
-    token = request.args.get('token')
-    if not token:
-        return False
-
-    login_token = UserLoginToken.query.filter_by(token=token).first()
-    if not login_token:
+    auth = authenticate_token(request.args.get('token'))
+    if not auth:
         return False
 
-    userid = login_token.userid
+    userid = auth[0]
     settings = data.get('settings')
 
-    user_settings = UserSettings.query.filter_by(userid=userid).first()
-    if user_settings:
-        user_settings.settings = json.dumps(settings)
-    else:
-        user_settings = UserSettings(
-            userid=userid, settings=json.dumps(settings))
-        db.session.add(user_settings)
-
-    db.session.commit()
+    # 广播不等待写库，其他标签页立即收到
+    buffer_user_settings(userid, settings)
     emit('settings_updated', settings, room=str(userid), include_self=False)
 
 
 def generate_rsa_keys():
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives import serialization
+
     private_key = rsa.generate_private_key(
         public_exponent=65537,
         key_size=2048,
@@ -158,28 +478,131 @@ def generate_rsa_keys():
     return private_pem, public_pem
 
 
-private_key_pem, public_key_pem = generate_rsa_keys()
+def write_private_key_file(path, private_pem, replace=True):
+    """先写临时文件再改名；replace 为 False 时只在目标不存在时写入，多个进程同时启动只有一个生效"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(private_pem)
+        f.flush()
+        os.fsync(f.fileno())
+    if replace:
+        os.replace(tmp_path, path)
+    else:
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        os.remove(tmp_path)
+
+
+def stat_rsa_key_file():
+    try:
+        st = os.stat(rsa_private_key_path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def load_rsa_keys():
+    """返回 ([当前私钥, 上一代私钥], 当前公钥 PEM)，密钥文件不存在时生成，被轮换后重新读取"""
+    global rsa_keys
+    from cryptography.hazmat.primitives import serialization
+
+    with rsa_keys_lock:
+        source = stat_rsa_key_file()
+        if rsa_keys is not None and source is not None and source == rsa_keys[0]:
+            return rsa_keys[1], rsa_keys[2]
+        if source is None:
+            private_pem, _ = generate_rsa_keys()
+            write_private_key_file(rsa_private_key_path, private_pem, replace=False)
+            source = stat_rsa_key_file()
+
+        private_keys = []
+        for path in (rsa_private_key_path, rsa_previous_key_path):
+            try:
+                with open(path, 'rb') as f:
+                    private_keys.append(
+                        serialization.load_pem_private_key(f.read(), password=None))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"Error loading RSA key {path}: {e}")
+        if not private_keys:
+            raise RuntimeError("No usable RSA private key")
+        public_pem = private_keys[0].public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        rsa_keys = (source, private_keys, public_pem)
+        return private_keys, public_pem
+
+
+def rotate_rsa_keys(force=False):
+    """当前密钥超过 RSA_KEY_MAX_AGE_DAYS 天后换新，旧密钥移到 previous 文件"""
+    try:
+        st = os.stat(rsa_private_key_path)
+    except FileNotFoundError:
+        # 还没有人请求过公钥，密钥会在第一次使用时由 load_rsa_keys 生成
+        return False
+    try:
+        if not force and time.time() - st.st_mtime < RSA_KEY_MAX_AGE_DAYS * 86400:
+            return False
+        with open(rsa_private_key_path, 'rb') as f:
+            current_pem = f.read()
+        private_pem, _ = generate_rsa_keys()
+        # 先保存旧密钥再替换当前密钥，任何时刻当前密钥文件都存在
+        write_private_key_file(rsa_previous_key_path, current_pem)
+        write_private_key_file(rsa_private_key_path, private_pem)
+    except OSError as e:
+        print(f"Error rotating RSA keys: {e}")
+        return False
+    logging.info("Rotated RSA login key")
+    return True
 
 
 class Event(db.Model):
+    __table_args__ = (
+        db.Index('ix_event_end_time_start_time', 'end_time', 'start_time'),
+        db.Index('ix_event_game_end_time', 'game', 'end_time'),
+        db.Index('ix_event_start_time_uuid', 'start_time', 'uuid'),
+        db.Index('ix_event_game_start_time_uuid', 'game', 'start_time', 'uuid'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(36), unique=True, nullable=False)
-    title = db.Column(db.String(200))
+    title = db.Column(db.String(200), index=True)
     game = db.Column(db.String(50))
     data = db.Column(db.Text)
     start_time = db.Column(db.DateTime)
     end_time = db.Column(db.DateTime)
     banner_image = db.Column(db.String(16384))
     event_type = db.Column(db.String(50))
+    fingerprint = db.Column(db.String(64), index=True)
 
     def __init__(self, **kwargs):
         super(Event, self).__init__(**kwargs)
         self.uuid = self.generate_uuid()
 
     def generate_uuid(self):
-        namespace = uuid.NAMESPACE_DNS
-        name = f"{self.game}-{self.title}"
-        return str(uuid.uuid3(namespace, name))
+        return event_uuid(self.game, self.title)
+
+
+def event_uuid(game, title):
+    namespace = uuid.NAMESPACE_DNS
+    name = f"{game}-{title}"
+    return str(uuid.uuid3(namespace, name))
+
+
+def event_fingerprint(announcement, title, start_time, end_time, banner_image, event_type):
+    """公告原文和派生字段的稳定哈希，用于快速判断活动是否变化"""
+    normalized = json.dumps([
+        announcement, title,
+        start_time.strftime('%Y-%m-%d %H:%M:%S'),
+        end_time.strftime('%Y-%m-%d %H:%M:%S'),
+        banner_image, event_type,
+    ], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
 
 
 class RequestLog(db.Model):
@@ -192,6 +615,15 @@ class RefreshLog(db.Model):
     refresh_time = db.Column(db.DateTime, default=datetime.now)
 
 
+class SnapshotLog(db.Model):
+    """每次发布快照时相对上一代的变化，用于 getnotice?since= 增量同步"""
+    generation = db.Column(db.Integer, primary_key=True)
+    added = db.Column(db.Text, nullable=False)
+    changed = db.Column(db.Text, nullable=False)
+    removed = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
 class User(db.Model):
     userid = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -205,10 +637,14 @@ class User(db.Model):
 
 
 class UserLoginToken(db.Model):
+    __table_args__ = (
+        db.Index('ix_user_login_token_userid_time', 'userid', 'time'),
+    )
+
     tokenid = db.Column(db.Integer, primary_key=True, autoincrement=True)
     userid = db.Column(db.Integer, db.ForeignKey(
         'user.userid'), nullable=False)
-    token = db.Column(db.String(256), nullable=False)
+    token = db.Column(db.String(256), nullable=False, index=True)
     time = db.Column(db.DateTime, nullable=False, default=datetime.now)
 
 
@@ -218,6 +654,76 @@ class UserSettings(db.Model):
     settings = db.Column(db.Text, nullable=False)
 
 
+def migrate_event_fingerprint():
+    columns = {row[1] for row in db.session.execute(
+        text("PRAGMA table_info(event)"))}
+    if 'fingerprint' not in columns:
+        db.session.execute(
+            text("ALTER TABLE event ADD COLUMN fingerprint VARCHAR(64)"))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_event_fingerprint ON event (fingerprint)"))
+
+    for event in Event.query.filter(Event.fingerprint.is_(None)).all():
+        try:
+            event.fingerprint = event_fingerprint(json.loads(
+                event.data), event.title, event.start_time, event.end_time, event.banner_image, event.event_type)
+        except (TypeError, ValueError, AttributeError) as e:
+            print(f"Error backfilling fingerprint for event {event.uuid}: {e}")
+
+
+def migrate_hot_query_indexes():
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_event_end_time_start_time ON event (end_time, start_time)",
+        "CREATE INDEX IF NOT EXISTS ix_event_title ON event (title)",
+        "CREATE INDEX IF NOT EXISTS ix_event_game_end_time ON event (game, end_time)",
+        "CREATE INDEX IF NOT EXISTS ix_user_login_token_token ON user_login_token (token)",
+        "CREATE INDEX IF NOT EXISTS ix_user_login_token_userid_time ON user_login_token (userid, time)",
+    ):
+        db.session.execute(text(statement))
+
+
+def migrate_events_api_indexes():
+    # /game-events/events 按 (start_time, uuid) 分页，可按游戏过滤
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_event_start_time_uuid ON event (start_time, uuid)",
+        "CREATE INDEX IF NOT EXISTS ix_event_game_start_time_uuid ON event (game, start_time, uuid)",
+    ):
+        db.session.execute(text(statement))
+
+
+# 按顺序执行，已执行的版本号记录在 SQLite 的 user_version 中，只能追加不能修改
+MIGRATIONS = [
+    migrate_event_fingerprint,
+    migrate_hot_query_indexes,
+    migrate_events_api_indexes,
+]
+
+
+def migrate_database():
+    """升级旧数据库，db.create_all() 不会为已存在的表补列和索引"""
+    version = db.session.execute(text("PRAGMA user_version")).scalar()
+    for target_version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            migration()
+            db.session.execute(text(f"PRAGMA user_version = {target_version}"))
+            db.session.commit()
+            print(f"Migrated database to version {target_version}: {migration.__name__}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error migrating database to version {target_version}: {e}")
+            raise
+
+
+def initialize_database():
+    """建表并升级数据库；gunicorn 的多个 worker 同时导入模块时用文件锁串行执行"""
+    with open(migrate_lock_path, 'a+', encoding='utf-8') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        with app.app_context():
+            db.create_all()
+            migrate_database()
+
+
 def generate_token():
     return secrets.token_hex(16)
 
@@ -233,15 +739,20 @@ def extract_floats(text):
     return [float(f) for f in floats]
 
 
-def is_time_to_update():
+def get_last_update_time():
     try:
         log = RequestLog.query.first()
-        if not log:
-            return True
-        now = datetime.now()
-        return (now - log.last_request_time) > timedelta(hours=24)
+        return log.last_request_time if log else None
     except Exception as e:
+        return None
+
+
+def is_time_to_update(last_update_time=None):
+    last_update_time = last_update_time or get_last_update_time()
+    if not last_update_time:
         return True
+    now = datetime.now()
+    return (now - last_update_time) > timedelta(hours=24)
 
 
 def update_request_log():
@@ -291,35 +802,105 @@ def extract_zzz_weapon_names(html_content):
         return ["音擎"]
 
 
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+YS_TIME_RE = re.compile(r"\d{4}/\d{2}/\d{2} \d{2}:\d{2}")
+YS_TIME_TITLE_RES = {title: re.compile(rf">{title}<.*?<p(?:\s[^>]*)?>(.*?)</p>", re.DOTALL)
+                     for title in ("〓获取奖励时限〓", "〓活动时间〓")}
+ZZZ_EVENT_TIME_RE = re.compile(
+    r"<p[^>]*>(?:<span[^>]*>)?[^<]*【活动时间】[^<]*(?:</span>)?</p>.*?<p(?:\s[^>]*)?>(.*?)</p>", re.DOTALL)
+WW_EVENT_TIME_RE = re.compile(
+    r"✦活动时间✦.*?<div[^>]*\sdata-line=\"true\"[^>]*>(.*?)</div>", re.DOTALL)
+IMG_TAG_RE = re.compile(r"<img(?=[\s/>])[^>]*>", re.IGNORECASE)
+IMG_SRC_RE = re.compile(r"(?<![\w-])src\s*=\s*(\"([^\"]*)\")?", re.IGNORECASE)
+
+
+class ParsedContent:
+    """公告正文。各提取函数共享同一个 BeautifulSoup 解析树，且只在正则快速路径未命中时才解析"""
+
+    def __init__(self, html_content):
+        self.html = html_content
+        self._soup = None
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            from bs4 import BeautifulSoup
+            self._soup = BeautifulSoup(self.html, 'html.parser')
+        return self._soup
+
+
+def as_parsed_content(content):
+    if isinstance(content, ParsedContent):
+        return content
+    return ParsedContent(content)
+
+
+def count_extract(name, path):
+    counter = extract_stats.setdefault(name, {"fast": 0, "fallback": 0})
+    counter[path] += 1
+
+
+def html_fragment_text(fragment, strip=False):
+    """去标签并反转义，结果与 BeautifulSoup 的 get_text() 一致"""
+    texts = [html.unescape(text) for text in HTML_TAG_RE.split(fragment)]
+    if strip:
+        return ''.join(text.strip() for text in texts)
+    return ''.join(texts)
+
+
 def extract_clean_time(html_time_str):
+    if '<' not in html_time_str and '&' not in html_time_str:
+        count_extract("clean_time", "fast")
+        return html_time_str.strip()
+    clean_time_str = html_fragment_text(html_time_str)
+    if '<' not in clean_time_str and '>' not in clean_time_str:
+        count_extract("clean_time", "fast")
+        return clean_time_str.strip()
+    count_extract("clean_time", "fallback")
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html_time_str, 'html.parser')
     clean_time_str = soup.get_text().strip()
     return clean_time_str
 
 
 def extract_ys_event_start_time(html_content):
-    if "版本更新后" not in html_content:
-        pattern = r"\d{4}/\d{2}/\d{2} \d{2}:\d{2}"
-        match = re.search(pattern, html_content)
+    content = as_parsed_content(html_content)
+    if "版本更新后" not in content.html:
+        match = YS_TIME_RE.search(content.html)
         if match:
+            count_extract("ys_event_start_time", "fast")
             first_datetime = match.group()
             return first_datetime
-    soup = BeautifulSoup(html_content, "html.parser")
-    reward_time_title = soup.find(
-        string="〓获取奖励时限〓") or soup.find(string="〓活动时间〓")
-    if reward_time_title:
-        reward_time_paragraph = reward_time_title.find_next("p")
-        if reward_time_paragraph:
+
+    for title, title_re in YS_TIME_TITLE_RES.items():
+        if title not in content.html:
+            continue
+        match = title_re.search(content.html)
+        if match and '<p' not in match.group(1):
+            count_extract("ys_event_start_time", "fast")
+            time_range = html_fragment_text(match.group(1))
+        else:
+            count_extract("ys_event_start_time", "fallback")
+            reward_time_title = content.soup.find(
+                string="〓获取奖励时限〓") or content.soup.find(string="〓活动时间〓")
+            reward_time_paragraph = reward_time_title.find_next(
+                "p") if reward_time_title else None
+            if not reward_time_paragraph:
+                return ""
             time_range = reward_time_paragraph.get_text()
-            if "~" in time_range:
-                text = re.sub("<[^>]+>", "", time_range.split("~")[0].strip())
-                return text
-            return re.sub("<[^>]+>", "", time_range)
-    return ""
+        break
+    else:
+        return ""
+
+    if "~" in time_range:
+        text = re.sub("<[^>]+>", "", time_range.split("~")[0].strip())
+        return text
+    return re.sub("<[^>]+>", "", time_range)
 
 
 def extract_ys_gacha_start_time_2(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
+    count_extract("ys_gacha_start_time_2", "fallback")
+    soup = as_parsed_content(html_content).soup
 
     # 尝试查找包含时间的td元素
     time_td = soup.find('td', {'rowspan': lambda x: x and int(x) >= 3})
@@ -333,7 +914,7 @@ def extract_ys_gacha_start_time_2(html_content):
 
     # 如果没有t_lc标签，尝试直接提取第一个时间格式
     time_text = time_td.get_text()
-    time_match = re.search(r'\d{4}/\d{2}/\d{2} \d{2}:\d{2}', time_text)
+    time_match = YS_TIME_RE.search(time_text)
     if time_match:
         return time_match.group()
 
@@ -341,7 +922,8 @@ def extract_ys_gacha_start_time_2(html_content):
 
 
 def extract_ys_gacha_start_time(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
+    count_extract("ys_gacha_start_time", "fallback")
+    soup = as_parsed_content(html_content).soup
     td_element = soup.find('td', {'rowspan': '3'})
     if td_element is None:
         td_element = soup.find('td', {'rowspan': '5'})
@@ -396,7 +978,18 @@ def extract_sr_gacha_start_time(html_content):
 
 
 def extract_zzz_event_start_end_time(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
+    content = as_parsed_content(html_content)
+
+    match = ZZZ_EVENT_TIME_RE.search(content.html)
+    if match and '<p' not in match.group(1):
+        count_extract("zzz_event_start_end_time", "fast")
+        activity_time_text = html_fragment_text(match.group(1), strip=True)
+        return split_zzz_event_time(activity_time_text)
+    if '【活动时间】' not in content.html:
+        return "", ""
+
+    count_extract("zzz_event_start_end_time", "fallback")
+    soup = content.soup
 
     # 尝试第一种情况：【活动时间】在p标签的直接文本中
     activity_time_label = soup.find(
@@ -415,28 +1008,32 @@ def extract_zzz_event_start_end_time(html_content):
 
         if activity_time_p:
             activity_time_text = activity_time_p.get_text(strip=True)
+            return split_zzz_event_time(activity_time_text)
 
-            # 处理分隔符（支持 - 或 ~）
-            if "-" in activity_time_text:
-                start, end = activity_time_text.split("-", 1)
-            elif "~" in activity_time_text:
-                start, end = activity_time_text.split("~", 1)
-            else:
-                return activity_time_text, ""  # 返回默认值
+    return "", ""
 
-            # 清理时间字符串
-            start = start.replace("（服务器时间）", "").strip()
-            end = end.replace("（服务器时间）", "").strip()
-            return start, end
 
-    return "", ""
+def split_zzz_event_time(activity_time_text):
+    # 处理分隔符（支持 - 或 ~）
+    if "-" in activity_time_text:
+        start, end = activity_time_text.split("-", 1)
+    elif "~" in activity_time_text:
+        start, end = activity_time_text.split("~", 1)
+    else:
+        return activity_time_text, ""  # 返回默认值
+
+    # 清理时间字符串
+    start = start.replace("（服务器时间）", "").strip()
+    end = end.replace("（服务器时间）", "").strip()
+    return start, end
 
 
 def extract_zzz_gacha_start_end_time(html_content):
-    soup = BeautifulSoup(html_content, "html.parser")
-    table = soup.find("table")
+    count_extract("zzz_gacha_start_end_time", "fallback")
+    content = as_parsed_content(html_content)
+    table = content.soup.find("table")
     if table is None:
-        raise Exception(html_content)
+        raise Exception(content.html)
 
     tbody = table.find("tbody")
     rows = tbody.find_all("tr")
@@ -472,48 +1069,312 @@ def extract_zzz_gacha_start_end_time(html_content):
 
 
 def extract_ww_event_start_end_time(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    activity_time_divs = soup.find_all('div', attrs={'data-line': 'true'})
+    content = as_parsed_content(html_content)
+    if '✦活动时间✦' not in content.html:
+        return "", ""
+
+    for match in WW_EVENT_TIME_RE.finditer(content.html):
+        activity_time = html_fragment_text(match.group(1), strip=True)
+        if "~" in activity_time and '<div' not in match.group(1):
+            count_extract("ww_event_start_end_time", "fast")
+            return split_ww_event_time(activity_time)
+
+    count_extract("ww_event_start_end_time", "fallback")
+    activity_time_divs = content.soup.find_all(
+        'div', attrs={'data-line': 'true'})
     for div in activity_time_divs:
         if div.find(string=lambda text: text and '✦活动时间✦' in text):
             time_div = div.find_next('div', attrs={'data-line': 'true'})
             if time_div:
                 activity_time = time_div.get_text(strip=True)
                 if "~" in activity_time:
-                    start_time = activity_time.split(
-                        "~")[0].replace("（服务器时间）", "").strip()
-                    end_time = activity_time.split(
-                        "~")[1].replace("（服务器时间）", "").strip()
-                    return start_time, end_time
+                    return split_ww_event_time(activity_time)
     return "", ""
 
 
-def update_event_fields(db_event, new_event_data):
-    fields_to_update = ['data', 'start_time', 'end_time',
-                        'banner_image', 'event_type']  # 'game',
-    for field in fields_to_update:
-        new_value = getattr(new_event_data, field)
-        if field == 'data':
-            db_value = json.loads(db_event.data)
-            new_value_json = json.loads(new_value)
-            if db_value != new_value_json:
-                db_event.data = json.dumps(new_value_json)
+def split_ww_event_time(activity_time):
+    start_time = activity_time.split(
+        "~")[0].replace("（服务器时间）", "").strip()
+    end_time = activity_time.split(
+        "~")[1].replace("（服务器时间）", "").strip()
+    return start_time, end_time
+
+
+def extract_first_image(html_content):
+    content = as_parsed_content(html_content)
+    if '<img' not in content.html.lower():
+        return ""
+    # 只看第一个 img 标签，且只有它恰好带一个双引号 src 时才走快速路径，其余情况交给解析树
+    tag = IMG_TAG_RE.search(content.html)
+    if tag and '<!--' not in content.html[:tag.start()]:
+        srcs = IMG_SRC_RE.findall(tag.group(0))
+        if len(srcs) == 1 and srcs[0][0] and srcs[0][1]:
+            count_extract("first_image", "fast")
+            return html.unescape(srcs[0][1])
+    count_extract("first_image", "fallback")
+    img_tag = content.soup.find('img')
+    if img_tag and 'src' in img_tag.attrs:
+        return img_tag['src']
+    return ""
+
+
+PARSED_FIELDS = ("title", "start_time", "end_time", "bannerImage", "event_type")
+
+
+def get_parse_cache():
+    global parse_cache
+    with parse_cache_lock:
+        if parse_cache is None:
+            try:
+                with open(parse_cache_path, 'r', encoding='utf-8') as f:
+                    parse_cache = json.load(f)
+            except (OSError, ValueError):
+                parse_cache = {}
+        return parse_cache
+
+
+def save_parse_cache():
+    cache = get_parse_cache()
+    with parse_cache_lock:
+        snapshot = dict(cache)
+    try:
+        tmp_path = f"{parse_cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, parse_cache_path)
+    except OSError as e:
+        print(f"Error saving parse cache: {e}")
+
+
+def init_parse_worker():
+    """解析子进程的初始化：释放继承来的调度锁，父进程退出时随之退出"""
+    global scheduler_lock_file
+    # 子进程持有的锁文件描述符会让 flock 在调度进程被杀后仍不释放，其他进程无法接管
+    if scheduler_lock_file is not None and scheduler_lock_file is not True:
+        scheduler_lock_file.close()
+    scheduler_lock_file = None
+
+    parent = multiprocessing.parent_process()
+    if parent is not None:
+        def exit_with_parent():
+            multiprocessing.connection.wait([parent.sentinel])
+            os._exit(1)
+        threading.Thread(target=exit_with_parent, name='parent-watch', daemon=True).start()
+
+
+def get_parse_pool():
+    global parse_pool, parse_pool_pid
+    with parse_pool_lock:
+        # fork 继承来的进程池不能在子进程中使用
+        if parse_pool is None or parse_pool_pid != os.getpid():
+            # fork 出的子进程直接继承已加载的模块，无需重新导入 g-server.py
+            parse_pool = ProcessPoolExecutor(
+                max_workers=PARSE_PROCESSES, mp_context=multiprocessing.get_context('fork'),
+                initializer=init_parse_worker)
+            parse_pool_pid = os.getpid()
+        return parse_pool
+
+
+def start_parse_pool():
+    """在启动线程之前创建解析进程，避免刷新过程中从多线程进程里 fork"""
+    if PARSE_PROCESSES > 0:
+        # fork 方式的进程池在第一次提交任务时一次性创建全部子进程
+        get_parse_pool().submit(os.getpid).result()
+
+
+def parse_job(process_func, announcement, ann_content, version_now, version_begin_time):
+    before = {name: dict(counter) for name, counter in extract_stats.items()}
+    process_func(announcement, ann_content, version_now, version_begin_time)
+    fields = {field: announcement[field]
+              for field in PARSED_FIELDS if field in announcement}
+    stats_delta = {name: {path: count - before.get(name, {}).get(path, 0) for path, count in counter.items()}
+                   for name, counter in extract_stats.items()}
+    return fields, stats_delta
+
+
+def run_parse_jobs(misses, version_now, version_begin_time):
+    global parse_pool
+    if PARSE_PROCESSES > 0 and len(misses) > 1:
+        try:
+            pool = get_parse_pool()
+            futures = [pool.submit(parse_job, process_func, announcement, ann_content, version_now, version_begin_time)
+                       for process_func, announcement, ann_content in misses]
+            results = [future.result() for future in futures]
+            # 子进程中的计数不会同步回来，需要手动合并
+            for _, stats_delta in results:
+                for name, counter in stats_delta.items():
+                    total = extract_stats.setdefault(
+                        name, {"fast": 0, "fallback": 0})
+                    for path, count in counter.items():
+                        total[path] += count
+            return [fields for fields, _ in results]
+        except BrokenProcessPool as e:
+            print(f"Parse pool broken, parsing inline: {repr(e)}")
+            with parse_pool_lock:
+                parse_pool = None
+
+    return [parse_job(process_func, announcement, ann_content, version_now, version_begin_time)[0]
+            for process_func, announcement, ann_content in misses]
+
+
+def run_process_jobs(game, jobs, version_now, version_begin_time):
+    """执行解析任务，公告和正文都未变化时直接套用上次的解析结果"""
+    cached_entries = get_parse_cache().get(game, {})
+    version = f"{version_now}|{version_begin_time}"
+    new_entries = {}
+    missed = []
+    for ann_id, process_func, announcement, ann_content in jobs:
+        content_hash = hashlib.sha256(json.dumps(
+            [announcement, ann_content], sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        entry = cached_entries.get(str(ann_id))
+        if entry and entry["hash"] == content_hash and entry["version"] == version:
+            announcement.update(entry["fields"])
+            new_entries[str(ann_id)] = entry
         else:
-            db_value = getattr(db_event, field)
-            if db_value != new_value:
-                setattr(db_event, field, new_value)
-    db.session.commit()
+            missed.append((ann_id, content_hash, process_func,
+                          announcement, ann_content))
+
+    results = run_parse_jobs([(process_func, announcement, ann_content) for _, _, process_func, announcement, ann_content in missed],
+                             version_now, version_begin_time)
+    for (ann_id, content_hash, _, announcement, _), fields in zip(missed, results):
+        announcement.update(fields)
+        new_entries[str(ann_id)] = {
+            "hash": content_hash, "version": version, "fields": fields}
+
+    # 只保留本次仍在上游列表中的公告
+    with parse_cache_lock:
+        parse_cache[game] = new_entries
+    parse_cache_stats[game] = {
+        "hit": len(jobs) - len(missed), "miss": len(missed)}
 
 
 def fetch_and_save_announcements():
-    session = requests.Session()
-    announcements = fetch_all_announcements(session)
-    process_and_save_announcements(announcements)
-    global cached_events
-    cached_events = None
+    session = create_session()
+    announcements, cache_entries = fetch_all_announcements(session)
+    save_parse_cache()
+    # 入库成功后才更新 HTTP 缓存，否则下次刷新会把未保存的数据当作“未变化”跳过
+    if process_and_save_announcements(announcements) is not None:
+        for entry in cache_entries:
+            save_http_cache_entry(entry)
+    if BANNER_CACHE_ENABLED:
+        cache_banner_images(session)
+    return publish_notice_snapshot()
+
+
+# 横幅文件名：原图内容的 sha256 加扩展名，缩略图另带宽度，内容不变文件名就不变
+BANNER_FILE_RE = re.compile(r"^[0-9a-f]{64}(\.w\d+\.webp|\.(jpg|png|gif|webp))$")
+BANNER_FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp"}
+
+
+def load_banner_index():
+    """横幅 URL -> {"file": 原图文件名, "thumb": 缩略图文件名}"""
+    try:
+        with open(banner_index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Error loading banner index: {e}")
+        return {}
+
+
+def save_banner_index(index):
+    try:
+        tmp_path = f"{banner_index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, banner_index_path)
+    except OSError as e:
+        print(f"Error saving banner index: {e}")
+
+
+def write_banner_file(name, data):
+    path = os.path.join(banner_cache_dir, name)
+    if os.path.exists(path):
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def make_banner_thumbnail(data):
+    """返回 (原图扩展名, 缩略图 WebP)，缩略图宽度不超过 BANNER_THUMB_WIDTH"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        extension = BANNER_FORMAT_EXTENSIONS.get(image.format)
+        if extension is None:
+            raise ValueError(f"unsupported image format {image.format}")
+        has_alpha = image.mode in ('RGBA', 'LA', 'P')
+        thumb = image.convert('RGBA' if has_alpha else 'RGB')
+    if thumb.width > BANNER_THUMB_WIDTH:
+        thumb.thumbnail((BANNER_THUMB_WIDTH, thumb.height), Image.LANCZOS)
+    output = io.BytesIO()
+    thumb.save(output, 'WEBP', quality=80)
+    return extension, output.getvalue()
+
+
+def cache_banner(session, url):
+    response = session.get(url, headers=req_headers, timeout=15)
+    response.raise_for_status()
+    data = response.content
+    if len(data) > BANNER_MAX_BYTES:
+        raise ValueError(f"banner too large ({len(data)} bytes)")
+    digest = hashlib.sha256(data).hexdigest()
+    extension, thumb = make_banner_thumbnail(data)
+    entry = {"file": f"{digest}{extension}",
+             "thumb": f"{digest}.w{BANNER_THUMB_WIDTH}.webp"}
+    write_banner_file(entry["file"], data)
+    write_banner_file(entry["thumb"], thumb)
+    return entry
+
+
+def cache_banner_images(session):
+    """把进行中活动的横幅下载到本地并生成缩略图，已缓存的 URL 不再下载"""
+    urls = {event.banner_image for event in Event.query.filter(Event.end_time > datetime.now())
+            if event.banner_image and event.banner_image.startswith(('http://', 'https://'))}
+    index = load_banner_index()
+    thumb_suffix = f".w{BANNER_THUMB_WIDTH}.webp"
+    missing = [url for url in urls
+               if url not in index or not index[url]["thumb"].endswith(thumb_suffix)]
+    stats = {"active": len(urls), "downloaded": 0, "errors": 0, "removed": 0}
+
+    os.makedirs(banner_cache_dir, exist_ok=True)
+    if missing:
+        with ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS) as executor:
+            futures = {url: executor.submit(cache_banner, session, url) for url in missing}
+            for url, future in futures.items():
+                try:
+                    index[url] = future.result()
+                    stats["downloaded"] += 1
+                except Exception as e:
+                    stats["errors"] += 1
+                    print(f"Error caching banner {url}: {e}")
+
+    # 只保留进行中活动的条目，长时间无人引用的文件删除
+    index = {url: entry for url, entry in index.items() if url in urls}
+    save_banner_index(index)
+    referenced = {name for entry in index.values() for name in entry.values()}
+    expire_before = time.time() - BANNER_RETENTION_DAYS * 86400
+    for name in os.listdir(banner_cache_dir):
+        if not BANNER_FILE_RE.match(name) or name in referenced:
+            continue
+        path = os.path.join(banner_cache_dir, name)
+        try:
+            if os.path.getmtime(path) < expire_before:
+                os.remove(path)
+                stats["removed"] += 1
+        except OSError as e:
+            print(f"Error removing banner {name}: {e}")
+
+    banner_cache_stats.clear()
+    banner_cache_stats.update(stats)
+    logging.info(f"Banner cache: {stats}")
 
 
 def fetch_all_announcements(session):
+    """返回 (各游戏的公告, 待写入的 HTTP 缓存条目)，只包含在截止时间内完成的游戏"""
     ann_list_urls = {
         "ys": "https://hk4e-ann-api.mihoyo.com/common/hk4e_cn/announcement/api/getAnnList?game=hk4e&game_biz=hk4e_cn&lang=zh-cn&bundle_id=hk4e_cn&level=1&platform=pc&region=cn_gf01&uid=1",
         "sr": "https://hkrpg-ann-api.mihoyo.com/common/hkrpg_cn/announcement/api/getAnnList?game=hkrpg&game_biz=hkrpg_cn&lang=zh-cn&bundle_id=hkrpg_cn&level=1&platform=pc&region=prod_gf_cn&uid=1",
@@ -528,39 +1389,153 @@ def fetch_all_announcements(session):
     }
 
     all_announcements = {}
-    for game, url in ann_list_urls.items():
-        try:
-            announcements = fetch_game_announcements(
-                session, game, url, ann_content_urls.get(game))
-            if announcements:
-                all_announcements[game] = announcements
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching {game} announcements: {repr(e)}")
+    cache_entries = []
+    stats = {}
+    started = {}
+    executor = ThreadPoolExecutor(
+        max_workers=FETCH_MAX_WORKERS, thread_name_prefix='fetch')
+
+    def timed_fetch(game, url):
+        started[game] = time.monotonic()
+        return fetch_game_announcements(
+            session, game, url, ann_content_urls.get(game))
+
+    futures = {executor.submit(timed_fetch, game, url): game
+               for game, url in ann_list_urls.items()}
+    total_deadline = time.monotonic() + FETCH_TOTAL_DEADLINE
+    pending = set(futures)
+    try:
+        while pending:
+            now = time.monotonic()
+            # 尚未开始的游戏只受整体截止时间限制
+            deadlines = {future: min(total_deadline, started.get(futures[future], now) + FETCH_GAME_DEADLINE)
+                         for future in pending}
+            timeout = max(0, min(deadlines.values()) - now)
+            done, pending = wait(
+                pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                game = futures[future]
+                elapsed = time.monotonic() - started.get(game, now)
+                try:
+                    announcements, entries, cache_stats = future.result()
+                    stats[game] = {"elapsed": round(elapsed, 3), "count": len(announcements or []),
+                                   "unchanged": announcements is None, "error": None,
+                                   "cache": cache_stats,
+                                   "parse": dict(parse_cache_stats.get(game, {}))}
+                    if announcements:
+                        all_announcements[game] = announcements
+                    cache_entries.extend(entries)
+                except Exception as e:
+                    stats[game] = {"elapsed": round(elapsed, 3), "count": 0,
+                                   "error": repr(e)}
+                    print(f"Error fetching {game} announcements: {repr(e)}")
+
+            now = time.monotonic()
+            for future in [f for f in pending if deadlines[f] <= now]:
+                game = futures[future]
+                pending.discard(future)
+                future.cancel()
+                stats[game] = {"elapsed": round(now - started.get(game, now), 3), "count": 0,
+                               "error": "deadline exceeded"}
+                print(f"Error fetching {game} announcements: deadline exceeded")
+    finally:
+        # 超时的请求线程无法强行终止，不再等待它们
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for game, game_stats in stats.items():
+        http_cache_stats[game] = game_stats.get("cache", {})
+    fetch_stats.clear()
+    fetch_stats.update(stats)
+    logging.info(f"Fetched announcements: {stats}")
+    logging.info(f"Content extraction fast path / fallback: {extract_stats}")
+    return all_announcements, cache_entries
+
+
+def http_cache_path(url):
+    return os.path.join(http_cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+
+def load_http_cache_entry(url):
+    try:
+        with open(http_cache_path(url), 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        return entry if entry.get('url') == url else None
+    except (OSError, ValueError):
+        return None
 
-    return all_announcements
+
+def save_http_cache_entry(entry):
+    try:
+        os.makedirs(http_cache_dir, exist_ok=True)
+        path = http_cache_path(entry['url'])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error saving http cache: {e}")
+
+
+def cached_get(session, url, timeout, stats):
+    """条件请求，返回 (解析后的 JSON, 内容是否变化, 待写入的缓存条目)，命中情况计入 stats"""
+    entry = load_http_cache_entry(url)
+    headers = dict(req_headers)
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    response = session.get(url, timeout=timeout, headers=headers)
+    if response.status_code == 304 and entry:
+        stats["hit"] += 1
+        return json.loads(entry['body']), False, None
+    response.raise_for_status()
+
+    body = response.content
+    new_entry = {
+        "url": url,
+        "etag": response.headers.get('ETag'),
+        "last_modified": response.headers.get('Last-Modified'),
+        "body_hash": hashlib.sha256(body).hexdigest(),
+        "body": body.decode('utf-8'),
+    }
+    changed = not entry or entry.get('body_hash') != new_entry['body_hash']
+    stats["hit" if not changed else "miss"] += 1
+    return json.loads(new_entry['body']), changed, new_entry
 
 
 def fetch_game_announcements(session, game, list_url, content_url=None):
+    """返回 (公告列表, 待写入的 HTTP 缓存条目, 缓存命中统计)，列表和内容都未变化时公告列表为 None
+
+    缓存条目由调用方在入库成功后写入；超时被放弃的线程不会修改共享的统计和缓存。
+    """
     version_now = "1.0"
     version_begin_time = "2024-11-01 00:00:01"
-    response = session.get(list_url, timeout=(5, 30), headers=req_headers)
-    response.raise_for_status()
-    data = response.json()
+    cache_stats = {"hit": 0, "miss": 0}
+    parse_cache_stats.pop(game, None)
+    data, list_changed, list_entry = cached_get(
+        session, list_url, (5, 30), cache_stats)
 
     if game != "ww" and content_url:
-        ann_content_response = session.get(
-            content_url, timeout=(5, 30), headers=req_headers)
-        ann_content_response.raise_for_status()
-        ann_content_data = ann_content_response.json()
+        ann_content_data, content_changed, content_entry = cached_get(
+            session, content_url, (5, 30), cache_stats)
         content_map = {item['ann_id']
             : item for item in ann_content_data['data']['list']}
         pic_content_map = {
             item['ann_id']: item for item in ann_content_data['data']['pic_list']}
     else:
+        content_changed, content_entry = False, None
         content_map = {}
         pic_content_map = {}
 
+    # 列表和内容都未变化时，跳过解析和入库
+    if not list_changed and not content_changed:
+        return None, [], cache_stats
+
     filtered_list = []
+    detail_failed = 0
 
     if game == "ys":
         filtered_list = process_ys_announcements(
@@ -572,10 +1547,16 @@ def fetch_game_announcements(session, game, list_url, content_url=None):
         filtered_list = process_zzz_announcements(
             data, content_map, pic_content_map, version_now, version_begin_time)
     elif game == "ww":
-        filtered_list = process_ww_announcements(
+        filtered_list, detail_failed = process_ww_announcements(
             session, data, version_now, version_begin_time)
 
-    return filtered_list
+    # 解析成功后才交给调用方，避免解析失败的内容在下次刷新时被跳过
+    # 有详情下载失败时不写入列表缓存，否则列表返回 304 后缺失的活动不会再被补回
+    if detail_failed:
+        print(f"Error fetching {game} details: {detail_failed} failed, list cache not updated")
+        list_entry = None
+    cache_entries = [entry for entry in (list_entry, content_entry) if entry]
+    return filtered_list, cache_entries, cache_stats
 
 
 def process_ys_announcements(data, content_map, version_now, version_begin_time):
@@ -596,6 +1577,7 @@ def process_ys_announcements(data, content_map, version_now, version_begin_time)
                     filtered_list.append(announcement)
                     break
 
+    jobs = []
     # Process event and gacha announcements
     for item in data["data"]["list"]:
         if item["type_label"] == "活动公告":
@@ -604,14 +1586,15 @@ def process_ys_announcements(data, content_map, version_now, version_begin_time)
                 clean_title = remove_html_tags(announcement["title"])
 
                 if "时限内" in clean_title or (announcement["tag_label"] == "活动" and title_filter("ys", clean_title)):
-                    process_ys_event(announcement, ann_content,
-                                     version_now, version_begin_time)
+                    jobs.append((announcement['ann_id'], process_ys_event,
+                                 announcement, ann_content))
                     filtered_list.append(announcement)
                 elif announcement["tag_label"] == "扭蛋":
-                    process_ys_gacha(announcement, ann_content,
-                                     version_now, version_begin_time)
+                    jobs.append((announcement['ann_id'], process_ys_gacha,
+                                 announcement, ann_content))
                     filtered_list.append(announcement)
 
+    run_process_jobs("ys", jobs, version_now, version_begin_time)
     return filtered_list
 
 
@@ -692,6 +1675,7 @@ def process_sr_announcements(data, content_map, pic_content_map, version_now, ve
                     version_begin_time = announcement["start_time"]
                     filtered_list.append(announcement)
 
+    jobs = []
     # Process event announcements from list
     for item in data["data"]["list"]:
         if item["type_label"] == "公告":
@@ -699,8 +1683,8 @@ def process_sr_announcements(data, content_map, pic_content_map, version_now, ve
                 ann_content = content_map[announcement['ann_id']]
                 clean_title = remove_html_tags(announcement["title"])
                 if title_filter("sr", clean_title):
-                    process_sr_event(announcement, ann_content,
-                                     version_now, version_begin_time)
+                    jobs.append((announcement['ann_id'], process_sr_event,
+                                 announcement, ann_content))
                     filtered_list.append(announcement)
 
     # Process event and gacha announcements from pic_list
@@ -710,14 +1694,15 @@ def process_sr_announcements(data, content_map, pic_content_map, version_now, ve
                 ann_content = pic_content_map[announcement['ann_id']]
                 clean_title = remove_html_tags(announcement["title"])
                 if title_filter("sr", clean_title):
-                    process_sr_pic_event(
-                        announcement, ann_content, version_now, version_begin_time)
+                    jobs.append((announcement['ann_id'], process_sr_pic_event,
+                                 announcement, ann_content))
                     filtered_list.append(announcement)
                 elif "跃迁" in clean_title:
-                    process_sr_gacha(announcement, ann_content,
-                                     version_now, version_begin_time)
+                    jobs.append((announcement['ann_id'], process_sr_gacha,
+                                 announcement, ann_content))
                     filtered_list.append(announcement)
 
+    run_process_jobs("sr", jobs, version_now, version_begin_time)
     return filtered_list
 
 
@@ -830,6 +1815,7 @@ def process_zzz_announcements(data, content_map, pic_content_map, version_now, v
                     version_begin_time = announcement["start_time"]
                     filtered_list.append(announcement)
 
+    jobs = []
     # Process event and gacha announcements from list
     for item in data["data"]["list"]:
         if item["type_id"] in [3, 4]:
@@ -837,12 +1823,12 @@ def process_zzz_announcements(data, content_map, pic_content_map, version_now, v
                 ann_content = content_map[announcement['ann_id']]
                 clean_title = remove_html_tags(announcement["title"])
                 if title_filter("zzz", clean_title) and "累计登录7天" not in ann_content['content']:
-                    process_zzz_event(announcement, ann_content,
-                                      version_now, version_begin_time)
+                    jobs.append((announcement['ann_id'], process_zzz_event,
+                                 announcement, ann_content))
                     filtered_list.append(announcement)
                 elif "限时频段" in clean_title:
-                    process_zzz_gacha(announcement, ann_content,
-                                      version_now, version_begin_time)
+                    jobs.append((announcement['ann_id'], process_zzz_gacha,
+                                 announcement, ann_content))
                     filtered_list.append(announcement)
 
     # Process event and gacha announcements from pic_list
@@ -852,14 +1838,15 @@ def process_zzz_announcements(data, content_map, pic_content_map, version_now, v
                 ann_content = pic_content_map[announcement['ann_id']]
                 clean_title = remove_html_tags(announcement["title"])
                 if title_filter("zzz", clean_title):
-                    process_zzz_pic_event(
-                        announcement, ann_content, version_now, version_begin_time)
+                    jobs.append((announcement['ann_id'], process_zzz_pic_event,
+                                 announcement, ann_content))
                     filtered_list.append(announcement)
                 elif "限时频段" in clean_title:
-                    process_zzz_pic_gacha(
-                        announcement, ann_content, version_now, version_begin_time)
+                    jobs.append((announcement['ann_id'], process_zzz_pic_gacha,
+                                 announcement, ann_content))
                     filtered_list.append(announcement)
 
+    run_process_jobs("zzz", jobs, version_now, version_begin_time)
     return filtered_list
 
 
@@ -1005,16 +1992,14 @@ def process_zzz_gacha(announcement, ann_content, version_now, version_begin_time
     announcement["title"] = clean_title
     announcement["event_type"] = "gacha"
 
+    content = ParsedContent(ann_content['content'])
     banner_image = announcement.get("banner", "")
     if not banner_image:
-        soup = BeautifulSoup(ann_content['content'], 'html.parser')
-        img_tag = soup.find('img')
-        if img_tag and 'src' in img_tag.attrs:
-            banner_image = img_tag['src']
+        banner_image = extract_first_image(content)
     announcement["bannerImage"] = banner_image
 
     ann_content_start_time, ann_content_end_time = extract_zzz_gacha_start_end_time(
-        ann_content['content'])
+        content)
     if f"{version_now}版本" in ann_content_start_time:
         announcement["start_time"] = version_begin_time
         try:
@@ -1039,6 +2024,7 @@ def process_zzz_gacha(announcement, ann_content, version_now, version_begin_time
 
 
 def process_ww_announcements(session, data, version_now, version_begin_time):
+    """返回 (公告列表, 详情下载失败的数量)"""
     filtered_list = []
 
     # Process version announcements
@@ -1058,23 +2044,46 @@ def process_ww_announcements(session, data, version_now, version_begin_time):
             filtered_list.append(announcement)
 
     # Process event and gacha announcements
+    # 先按标题过滤，只下载需要的活动详情
+    selected = []
     for announcement in data["activity"]:
         clean_title = remove_html_tags(announcement["tabTitle"]["zh-Hans"])
-        ann_content_response = session.get(
-            announcement['contentPrefix'][0] + "zh-Hans.json", timeout=(5, 20), headers=req_headers)
-        ann_content_response.raise_for_status()
-        ann_content_data = ann_content_response.json()
-
         if title_filter("ww", clean_title):
-            process_ww_event(announcement, ann_content_data,
-                             version_now, version_begin_time)
-            filtered_list.append(announcement)
+            selected.append((announcement, process_ww_event))
         elif "唤取" in clean_title:
-            process_ww_gacha(announcement, ann_content_data,
-                             version_now, version_begin_time)
-            filtered_list.append(announcement)
+            selected.append((announcement, process_ww_gacha))
 
-    return filtered_list
+    with ThreadPoolExecutor(max_workers=WW_DETAIL_WORKERS, thread_name_prefix='ww-detail') as executor:
+        contents = list(executor.map(
+            lambda item: fetch_ww_content(session, item[0]), selected))
+
+    jobs = []
+    failed = 0
+    for (announcement, process_func), ann_content_data in zip(selected, contents):
+        if ann_content_data is None:
+            failed += 1
+            continue
+        jobs.append((announcement['contentPrefix'][0], process_func,
+                     announcement, ann_content_data))
+        filtered_list.append(announcement)
+    run_process_jobs("ww", jobs, version_now, version_begin_time)
+
+    return filtered_list, failed
+
+
+def fetch_ww_content(session, announcement):
+    url = announcement['contentPrefix'][0] + "zh-Hans.json"
+    for attempt in range(WW_DETAIL_RETRIES + 1):
+        try:
+            ann_content_response = session.get(
+                url, timeout=(5, 20), headers=req_headers)
+            ann_content_response.raise_for_status()
+            return ann_content_response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if attempt == WW_DETAIL_RETRIES:
+                print(f"Error fetching ww content {url}: {repr(e)}")
+                return None
+            time.sleep(0.5 * (attempt + 1))
 
 
 def process_ww_event(announcement, ann_content_data, version_now, version_begin_time):
@@ -1164,54 +2173,186 @@ def process_ww_gacha(announcement, ann_content_data, version_now, version_begin_
             pass
 
 
+EVENT_UPDATE_FIELDS = ('data', 'start_time', 'end_time',
+                       'banner_image', 'event_type', 'fingerprint')
+UPSERT_BATCH_SIZE = 100
+
+
+def announcement_to_row(game, announcement):
+    title = announcement["title"]
+    row = {
+        "uuid": event_uuid(game, title),
+        "title": title,
+        "game": game,
+        "data": json.dumps(announcement),
+        "start_time": datetime.strptime(announcement.get(
+            "start_time", ""), '%Y-%m-%d %H:%M:%S'),
+        "end_time": datetime.strptime(announcement.get(
+            "end_time", ""), '%Y-%m-%d %H:%M:%S'),
+        "banner_image": announcement.get("bannerImage", ""),
+        "event_type": announcement.get("event_type", ""),
+    }
+    row["fingerprint"] = event_fingerprint(
+        announcement, title, row["start_time"], row["end_time"], row["banner_image"], row["event_type"])
+    return row
+
+
 def process_and_save_announcements(announcements):
+    """一次查询取出已有活动，在内存中比对后用一个事务批量 upsert，写入失败时返回 None"""
+    rows = {}
     for game, game_announcements in announcements.items():
         for announcement in game_announcements:
-            save_or_update_announcement(game, announcement)
+            try:
+                row = announcement_to_row(game, announcement)
+            except (KeyError, ValueError) as e:
+                print(f"Error saving event: {e}")
+                continue
+            # 同一次刷新中重复的公告以最后一条为准
+            rows[row["uuid"]] = row
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "changed": []}
+    if not rows:
+        return counts
+
+    existing_events = {event.uuid: event for event in Event.query.filter(
+        Event.uuid.in_(list(rows))).all()}
+    upserts = []
+    for event_uuid_value, row in rows.items():
+        existing_event = existing_events.get(event_uuid_value)
+        if existing_event is None:
+            counts["inserted"] += 1
+        elif existing_event.fingerprint != row["fingerprint"]:
+            counts["updated"] += 1
+        else:
+            counts["unchanged"] += 1
+            continue
+        counts["changed"].append(event_uuid_value)
+        upserts.append(row)
 
+    try:
+        for i in range(0, len(upserts), UPSERT_BATCH_SIZE):
+            stmt = sqlite_insert(Event).values(
+                upserts[i:i + UPSERT_BATCH_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['uuid'],
+                set_={field: stmt.excluded[field] for field in EVENT_UPDATE_FIELDS})
+            db.session.execute(stmt)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error saving events: {e}")
+        return None
 
-def save_or_update_announcement(game, announcement):
-    title = announcement["title"]
-    existing_event = Event.query.filter_by(title=title).first()
-
-    if existing_event:
-        new_event_data = Event(
-            title=title,
-            game=game,
-            data=json.dumps(announcement),
-            start_time=datetime.strptime(announcement.get(
-                "start_time", ""), '%Y-%m-%d %H:%M:%S'),
-            end_time=datetime.strptime(announcement.get(
-                "end_time", ""), '%Y-%m-%d %H:%M:%S'),
-            banner_image=announcement.get("bannerImage", ""),
-            event_type=announcement.get("event_type", ""),
-        )
-        update_event_fields(existing_event, new_event_data)
-    else:
-        try:
-            new_event = Event(
-                title=title,
-                game=game,
-                data=json.dumps(announcement),
-                start_time=datetime.strptime(announcement.get(
-                    "start_time", ""), '%Y-%m-%d %H:%M:%S'),
-                end_time=datetime.strptime(announcement.get(
-                    "end_time", ""), '%Y-%m-%d %H:%M:%S'),
-                banner_image=announcement.get("bannerImage", ""),
-                event_type=announcement.get("event_type", ""),
-            )
-            db.session.add(new_event)
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            print(f"Error saving event: {e}")
+    logging.info(f"Saved events: {counts}")
+    return counts
+
+
+def refresh_announcements():
+    """抓取并保存公告，同一时间只允许一个刷新，已有刷新进行中时直接返回 False"""
+    if not refresh_lock.acquire(blocking=False):
+        return False
+    try:
+        with app.app_context():
+            generation = fetch_and_save_announcements()
+            update_request_log()
+            log_refresh_time()
+            if generation:
+                broadcast_events_updated(generation)
+    except Exception as e:
+        print(f"Error refreshing announcements: {repr(e)}")
+    finally:
+        refresh_lock.release()
+    return True
+
+
+def broadcast_events_updated(generation):
+    """每次刷新最多推送一次，内容和 getnotice?since=generation-1 相同
+
+    没有变化时不推送；落后不止一代的客户端收到后自己再请求增量。
+    """
+    # 直接读取刚发布的快照文件；get_notice_snapshot 在其他线程持锁时会返回旧快照
+    snapshot = load_notice_snapshot()
+    if snapshot is None or snapshot.generation != generation:
+        return
+    delta = build_notice_delta(snapshot, generation - 1)
+    if delta["full"] or not (delta["events"] or delta["removed"]):
+        return
+    try:
+        socketio.emit('events_updated', delta)
+    except Exception as e:
+        print(f"Error broadcasting events update: {e}")
+
+
+def start_background_refresh():
+    if refresh_lock.locked():
+        return False
+    threading.Thread(target=refresh_announcements,
+                     name='refresh', daemon=True).start()
+    return True
 
 
 def scheduled_task():
+    # 只有持有调度租约的进程才访问上游，其余进程读取它发布的快照
+    if is_scheduler_leader():
+        refresh_announcements()
+
+
+def is_scheduler_leader():
+    # gunicorn --preload 时 worker 由主进程 fork 而来，会继承 scheduler_lock_file，只认实际取得锁的进程
+    return scheduler_lock_file is not None and scheduler_lock_pid == os.getpid()
+
+
+def acquire_scheduler_lease():
+    """尝试获取调度租约（lock 文件上的 flock），持有者进程退出后锁自动释放，由其他进程接管"""
+    global scheduler_lock_file, scheduler_lock_pid
+    if scheduler_lock_file is not None and scheduler_lock_pid != os.getpid():
+        # fork 继承来的锁文件属于父进程；关闭本进程的描述符不会释放父进程持有的锁
+        if scheduler_lock_file is not True:
+            scheduler_lock_file.close()
+        scheduler_lock_file = None
+    if scheduler_lock_file is None:
+        if fcntl is None:
+            # 不支持 flock 的平台上只能按单进程部署
+            scheduler_lock_file = True
+            scheduler_lock_pid = os.getpid()
+            return True
+        lock_file = open(scheduler_lock_path, 'a+', encoding='utf-8')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        scheduler_lock_file = lock_file
+        scheduler_lock_pid = os.getpid()
+        logging.info(f"Process {os.getpid()} is now the scheduler leader")
+
+    if fcntl is not None:
+        scheduler_lock_file.seek(0)
+        scheduler_lock_file.truncate()
+        scheduler_lock_file.write(json.dumps({
+            "pid": os.getpid(),
+            "heartbeat": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }))
+        scheduler_lock_file.flush()
+    return True
+
+
+def get_scheduler_leader():
+    try:
+        with open(scheduler_lock_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def scheduler_heartbeat():
+    if not acquire_scheduler_lease():
+        return
+    rotate_rsa_keys()
+    # 数据过期时由调度进程刷新，getnotice 所在进程不一定是调度进程
     with app.app_context():
-        fetch_and_save_announcements()
-        update_request_log()
-        log_refresh_time()
+        if is_time_to_update():
+            start_background_refresh()
 
 
 def log_refresh_time():
@@ -1224,84 +2365,439 @@ def log_refresh_time():
         print(f"Error logging refresh time: {e}")
 
 
-cached_events = None
+class NoticeSnapshot:
+    """getnotice 的响应快照，序列化、压缩和 ETag 只在生成时计算一次。
+
+    快照生成后不再修改，更新时整体替换 notice_snapshot 的引用。
+    """
+
+    def __init__(self, events, generation, body=None, source=None):
+        self.events = events
+        self.generation = generation
+        # 快照文件的 (mtime, inode, size)，用于判断其他进程是否发布了新快照
+        self.source = source
+        self.body = body if body is not None else json.dumps(
+            events, ensure_ascii=False).encode('utf-8')
+        self.etag = f"{generation}-{hashlib.sha1(self.body).hexdigest()[:16]}"
+        self.encoded = {
+            'gzip': gzip.compress(self.body),
+            'deflate': zlib.compress(self.body),
+        }
+        # 快照中最早结束的活动时间，到点后需要把已结束的活动移除
+        end_times = [datetime.strptime(event["end_time"], '%Y-%m-%d %H:%M:%S')
+                     for game_events in events.values() for event in game_events]
+        self.expires_at = min(end_times) if end_times else None
+
+    def is_expired(self, now):
+        return self.expires_at is not None and now >= self.expires_at
+
+    def without_expired(self, now):
+        """不查数据库，直接从当前快照中去掉已结束的活动，各进程得到的结果相同"""
+        now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+        events = {game: [event for event in game_events if event["end_time"] > now_str]
+                  for game, game_events in self.events.items()}
+        return NoticeSnapshot(events, self.generation, source=self.source)
+
+
+notice_snapshot = None
+notice_snapshot_lock = threading.Lock()
+notice_snapshot_stats = {"rebuilds": 0, "expiry_prunes": 0}
+# 保留最近多少代快照的变化记录，客户端落后更多时返回全量
+NOTICE_LOG_SIZE = 50
+
+
+def stat_notice_snapshot_file():
+    try:
+        st = os.stat(notice_snapshot_path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def read_notice_snapshot_file():
+    """读取快照文件，返回 (头部信息, 响应体, 文件标识)
+
+    响应体本来就要作为 bytes 交给 json.loads 和响应对象，直接整体读取，不用 mmap。
+    """
+    try:
+        with open(notice_snapshot_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            header = json.loads(f.readline())
+            body = f.read()
+        return header, body, (st.st_mtime_ns, st.st_ino, st.st_size)
+    except (OSError, ValueError) as e:
+        print(f"Error reading notice snapshot: {e}")
+        return None
+
+
+def publish_notice_snapshot(replace=True):
+    """把 getnotice 快照写到 events.sqlite3 旁，所有 worker 进程都从这个文件读取
+
+    replace 为 False 时只在文件不存在时写入，用于首次启动时多个进程同时生成快照。
+    """
+    previous = read_notice_snapshot_file() if os.path.exists(
+        notice_snapshot_path) else None
+    generation = previous[0].get("generation", 0) + 1 if previous else 1
+    # 快照文件被删除后代数不能回退，否则会和已有的变化记录冲突
+    last_logged = db.session.query(db.func.max(SnapshotLog.generation)).scalar()
+    if last_logged is not None:
+        generation = max(generation, last_logged + 1)
+    events = build_notice_events(datetime.now())
+    if previous:
+        # 先写变化记录再替换文件，其他进程读到新快照时一定能查到对应记录
+        log_notice_changes(generation, json.loads(previous[1]), events)
+    header = {"generation": generation,
+              "published_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    tmp_path = f"{notice_snapshot_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(json.dumps(events, ensure_ascii=False).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        if replace:
+            os.replace(tmp_path, notice_snapshot_path)
+        else:
+            try:
+                os.link(tmp_path, notice_snapshot_path)
+            except FileExistsError:
+                pass
+            os.remove(tmp_path)
+    except OSError as e:
+        print(f"Error publishing notice snapshot: {e}")
+        return None
+    return generation
+
+
+def notice_events_by_uuid(events):
+    return {event["uuid"]: event for game_events in events.values() for event in game_events}
+
+
+def log_notice_changes(generation, previous_events, events):
+    """记录这一代快照相对上一代新增、变化和移除的活动 uuid"""
+    before = notice_events_by_uuid(previous_events)
+    after = notice_events_by_uuid(events)
+    added = [uuid for uuid in after if uuid not in before]
+    changed = [uuid for uuid in after if uuid in before and after[uuid] != before[uuid]]
+    removed = [uuid for uuid in before if uuid not in after]
+    try:
+        db.session.add(SnapshotLog(generation=generation,
+                                   added=json.dumps(added),
+                                   changed=json.dumps(changed),
+                                   removed=json.dumps(removed)))
+        SnapshotLog.query.filter(
+            SnapshotLog.generation <= generation - NOTICE_LOG_SIZE).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error logging notice changes: {e}")
+
+
+def build_notice_delta(snapshot, since):
+    """返回 since 代之后的变化；记录不全或 since 无效时让客户端重新拉取全量"""
+    generation = snapshot.generation
+    if since == generation:
+        return {"generation": generation, "full": False, "events": {}, "removed": []}
+    logs = []
+    if 0 <= since < generation:
+        logs = SnapshotLog.query.filter(SnapshotLog.generation > since,
+                                        SnapshotLog.generation <= generation).all()
+    if len(logs) != generation - since:
+        return {"generation": generation, "full": True}
+
+    touched = set()
+    for log in logs:
+        touched.update(json.loads(log.added))
+        touched.update(json.loads(log.changed))
+        touched.update(json.loads(log.removed))
+    # 已结束的活动会从快照中剪掉，但不会产生变化记录，客户端按 order 自行丢弃
+    current = notice_events_by_uuid(snapshot.events)
+    return {
+        "generation": generation,
+        "full": False,
+        "events": {uuid: current[uuid] for uuid in touched if uuid in current},
+        "removed": sorted(uuid for uuid in touched if uuid not in current),
+        "order": {game: [event["uuid"] for event in game_events]
+                  for game, game_events in snapshot.events.items()},
+    }
+
+
+def load_notice_snapshot():
+    loaded = read_notice_snapshot_file()
+    if loaded is None:
+        return None
+    header, body, source = loaded
+    return NoticeSnapshot(json.loads(body), header["generation"], body=body, source=source)
+
+
+def get_notice_snapshot(now):
+    global notice_snapshot
+    snapshot = notice_snapshot
+    source = stat_notice_snapshot_file()
+    if snapshot is not None and snapshot.source == source and not snapshot.is_expired(now):
+        return snapshot
+
+    # 已有快照时只让一个线程重建，其余线程先返回上一代快照；冷启动时则等待重建完成
+    if not notice_snapshot_lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        snapshot = notice_snapshot
+        source = stat_notice_snapshot_file()
+        if source is None:
+            # 还没有任何进程发布过快照
+            publish_notice_snapshot(replace=False)
+            source = stat_notice_snapshot_file()
+
+        if snapshot is None or snapshot.source != source:
+            snapshot = load_notice_snapshot()
+            if snapshot is None and publish_notice_snapshot():
+                # 快照文件损坏时重新发布
+                snapshot = load_notice_snapshot()
+            if snapshot is None:
+                # 快照文件不可用时退回到直接查询数据库
+                snapshot = NoticeSnapshot(build_notice_events(now), 0)
+            notice_snapshot_stats["rebuilds"] += 1
+        if snapshot.is_expired(now):
+            snapshot = snapshot.without_expired(now)
+            notice_snapshot_stats["expiry_prunes"] += 1
+        notice_snapshot = snapshot
+        return snapshot
+    finally:
+        notice_snapshot_lock.release()
+
+
+def build_notice_events(now):
+    active_events = Event.query.filter(Event.end_time > now).order_by(
+        Event.start_time.asc(), Event.end_time.asc()).all()
+    banner_index = load_banner_index() if BANNER_CACHE_ENABLED else {}
+    results = {}
+    for event in active_events:
+        if event.game not in results:
+            results[event.game] = []
+        if event.event_type == "gacha" or title_filter(event.game, event.title):
+            item = {
+                "title": event.title,
+                "start_time": event.start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "end_time": event.end_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "bannerImage": event.banner_image,
+                "uuid": event.uuid,
+                "event_type": event.event_type,
+            }
+            banner = banner_index.get(event.banner_image)
+            if banner:
+                item["bannerLocal"] = f"/game-events/banner/{banner['file']}"
+                item["bannerThumb"] = f"/game-events/banner/{banner['thumb']}"
+            results[event.game].append(item)
+
+    for game, events in results.items():
+        version_events = [
+            event for event in events if "版本" in event["title"]]
+        other_events = [
+            event for event in events if "版本" not in event["title"]]
+        results[game] = version_events + other_events
+
+    for game, events in results.items():
+        other_events = [
+            event for event in events if event["event_type"] != "gacha"]
+        gacha_events = [
+            event for event in events if event["event_type"] == "gacha"]
+        results[game] = other_events + gacha_events
+
+    if "ww" in results:
+        ww_events = results["ww"]
+        # 将包含“武器”的事件单独提取出来
+        weapon_events = [
+            event for event in ww_events if "武器" in event["title"]]
+        non_weapon_events = [
+            event for event in ww_events if "武器" not in event["title"]]
+        # 将非武器事件排在前面，武器事件排在最后
+        results["ww"] = non_weapon_events + weapon_events
+
+    return results
 
 
 @app.route("/game-events/getnotice", methods=["GET"])
 @cache_control('no-cache')
 def get_notice():
-    global cached_events
-
-    if is_time_to_update():
-        fetch_and_save_announcements()
-        update_request_log()
+    # 数据过期时先返回现有数据，再由调度进程在后台刷新
+    last_update_time = get_last_update_time()
+    if is_time_to_update(last_update_time) and is_scheduler_leader():
+        start_background_refresh()
 
     now = datetime.now()
 
-    # 如果缓存为空，或者需要更新缓存
-    if cached_events is None:
-        active_events = Event.query.filter(Event.end_time > now).order_by(
-            Event.start_time.asc(), Event.end_time.asc()).all()
-        results = {}
-        for event in active_events:
-            if event.game not in results:
-                results[event.game] = []
-            if event.event_type == "gacha" or title_filter(event.game, event.title):
-                results[event.game].append({
-                    "title": event.title,
-                    "start_time": event.start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    "end_time": event.end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    "bannerImage": event.banner_image,
-                    "uuid": event.uuid,
-                    "event_type": event.event_type,
-                })
-
-        for game, events in results.items():
-            version_events = [
-                event for event in events if "版本" in event["title"]]
-            other_events = [
-                event for event in events if "版本" not in event["title"]]
-            results[game] = version_events + other_events
-
-        for game, events in results.items():
-            other_events = [
-                event for event in events if event["event_type"] != "gacha"]
-            gacha_events = [
-                event for event in events if event["event_type"] == "gacha"]
-            results[game] = other_events + gacha_events
-
-        if "ww" in results:
-            ww_events = results["ww"]
-            # 将包含“武器”的事件单独提取出来
-            weapon_events = [
-                event for event in ww_events if "武器" in event["title"]]
-            non_weapon_events = [
-                event for event in ww_events if "武器" not in event["title"]]
-            # 将非武器事件排在前面，武器事件排在最后
-            results["ww"] = non_weapon_events + weapon_events
-
-        cached_events = results
-    # else:
-        # logging.info("命中缓存")
-
-    response = make_response(json.dumps(cached_events, ensure_ascii=False))
-    response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    snapshot = get_notice_snapshot(now)
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        response = jsonify(build_notice_delta(snapshot, since))
+        response.headers['X-Notice-Generation'] = str(snapshot.generation)
+        return response
+
+    if request.if_none_match.contains_weak(snapshot.etag):
+        response = make_response('', 304)
+    else:
+        encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+        response = make_response(snapshot.encoded.get(encoding, snapshot.body))
+        response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(snapshot.etag)
+    response.vary.add('Accept-Encoding')
+    response.headers['X-Notice-Generation'] = str(snapshot.generation)
+    if last_update_time:
+        response.headers['X-Data-Age'] = str(
+            max(0, int((now - last_update_time).total_seconds())))
+    response.headers['X-Refresh-In-Progress'] = '1' if refresh_lock.locked() else '0'
     return response
 
 
+# /game-events/events 每页条数，以及可以选择返回的字段
+EVENTS_PAGE_SIZE = 50
+EVENTS_MAX_PAGE_SIZE = 200
+EVENT_API_FIELDS = ("uuid", "game", "title", "start_time", "end_time", "bannerImage", "event_type")
+EVENT_API_GAMES = ("ys", "sr", "zzz", "ww")
+
+
+class EventQueryError(ValueError):
+    pass
+
+
+def parse_query_time(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise EventQueryError(f"invalid {name}: {value}")
+    # 数据库中保存的是本地时间
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def parse_query_list(name, allowed=None):
+    value = request.args.get(name)
+    if not value:
+        return None
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    if allowed is not None:
+        unknown = [item for item in items if item not in allowed]
+        if unknown:
+            raise EventQueryError(f"invalid {name}: {','.join(unknown)}")
+    return items
+
+
+def encode_events_cursor(start_time, uuid):
+    raw = json.dumps([start_time.strftime('%Y-%m-%d %H:%M:%S'), uuid]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_events_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        start_time, uuid = json.loads(raw)
+        return datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S'), str(uuid)
+    except (ValueError, TypeError):
+        raise EventQueryError("invalid cursor")
+
+
+def build_events_query(games, event_types, time_from, time_to, active_at, fields):
+    # 只查需要的列，不读取保存公告原文的 data 列，横幅地址也只在请求时读取
+    columns = [Event.uuid, Event.game, Event.title, Event.start_time,
+               Event.end_time, Event.event_type]
+    if "bannerImage" in fields:
+        columns.append(Event.banner_image)
+    query = db.session.query(*columns)
+    if games:
+        query = query.filter(Event.game.in_(games))
+    if event_types:
+        query = query.filter(Event.event_type.in_(event_types))
+    # 与 [from, to) 时间段有重叠的活动
+    if time_from:
+        query = query.filter(Event.end_time > time_from)
+    if time_to:
+        query = query.filter(Event.start_time < time_to)
+    if active_at:
+        query = query.filter(Event.start_time <= active_at, Event.end_time > active_at)
+    return query.order_by(Event.start_time.asc(), Event.uuid.asc())
+
+
+@app.route('/game-events/events', methods=['GET'])
+@cache_control('no-cache')
+def query_events():
+    """按游戏、类型和时间过滤活动，按 (start_time, uuid) 翻页，cursor 取自上一页的 next_cursor"""
+    try:
+        games = parse_query_list('game', EVENT_API_GAMES)
+        event_types = parse_query_list('event_type')
+        fields = parse_query_list('fields', EVENT_API_FIELDS) or list(EVENT_API_FIELDS)
+        time_from = parse_query_time('from')
+        time_to = parse_query_time('to')
+        active_at = parse_query_time('active_at')
+        limit = request.args.get('limit')
+        try:
+            limit = int(limit) if limit is not None else EVENTS_PAGE_SIZE
+        except ValueError:
+            raise EventQueryError(f"invalid limit: {limit}")
+        if limit < 1:
+            raise EventQueryError(f"invalid limit: {limit}")
+        limit = min(limit, EVENTS_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        after = decode_events_cursor(cursor) if cursor else None
+    except EventQueryError as e:
+        return jsonify({"code": 400, "message": str(e)}), 400
+
+    query = build_events_query(games, event_types, time_from, time_to, active_at, fields)
+    # 与 getnotice 一样隐藏 title_filter 过滤掉的公告；被过滤的行也推进游标，
+    # 每次多取一些直到凑够 limit + 1 条，多出的一条用于判断是否还有下一页
+    rows = []
+    while len(rows) <= limit:
+        batch_query = query
+        if after:
+            batch_query = batch_query.filter(
+                db.tuple_(Event.start_time, Event.uuid) > db.tuple_(*after))
+        batch = batch_query.limit(limit + 1).all()
+        for row in batch:
+            after = (row.start_time, row.uuid)
+            if row.event_type == "gacha" or title_filter(row.game, row.title):
+                rows.append(row)
+                if len(rows) > limit:
+                    break
+        if len(batch) <= limit:
+            break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_events_cursor(rows[-1].start_time, rows[-1].uuid)
+
+    field_getters = {
+        "uuid": lambda row: row.uuid,
+        "game": lambda row: row.game,
+        "title": lambda row: row.title,
+        "start_time": lambda row: row.start_time.strftime('%Y-%m-%d %H:%M:%S'),
+        "end_time": lambda row: row.end_time.strftime('%Y-%m-%d %H:%M:%S'),
+        "bannerImage": lambda row: row.banner_image,
+        "event_type": lambda row: row.event_type,
+    }
+    events = [{field: field_getters[field](row) for field in fields} for row in rows]
+    return jsonify({"events": events, "next_cursor": next_cursor})
+
+
 def limit_user_tokens(userid):
     tokens = UserLoginToken.query.filter_by(
         userid=userid).order_by(UserLoginToken.time.asc()).all()
     if len(tokens) > 10:
+        evicted_token = tokens[0].token
         db.session.delete(tokens[0])
         db.session.commit()
+        invalidate_token(evicted_token)
 
 
-def decrypt_password(encrypted_password, private_key_pem):
-    private_key = serialization.load_pem_private_key(
-        private_key_pem,
-        password=None,
-    )
+def decrypt_password(encrypted_password, private_key):
+    from cryptography.hazmat.primitives.asymmetric import padding
+
     # print(encrypted_password)
     encrypted_password_bytes = base64.b64decode(encrypted_password)
     decrypted_password = private_key.decrypt(
@@ -1319,6 +2815,28 @@ def update_existing_passwords():
             db.session.commit()
 
 
+def verify_password(password_hash, password):
+    """在 scrypt 线程池中校验密码，排队已满时返回 None"""
+    if not password_hash_slots.acquire(timeout=PASSWORD_HASH_QUEUE_TIMEOUT):
+        return None
+    try:
+        return password_hash_executor.submit(
+            check_password_hash, password_hash, password).result()
+    finally:
+        password_hash_slots.release()
+
+
+def get_geetest_session():
+    global geetest_session
+    with geetest_session_lock:
+        if geetest_session is None:
+            geetest_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PASSWORD_HASH_QUEUE)
+            geetest_session.mount('http://', adapter)
+            geetest_session.mount('https://', adapter)
+        return geetest_session
+
+
 def validate_geetest(validate):
     global geetest_config
     if not geetest_config:  # 如果配置不存在或无效，直接返回 True（跳过验证）
@@ -1346,10 +2864,11 @@ def validate_geetest(validate):
         "gen_time": gen_time,
         "sign_token": sign_token,
     }
-    url = f"http://gcaptcha4.geetest.com/validate?captcha_id={captcha_id}"
+    url = f"{GEETEST_VALIDATE_URL}?captcha_id={captcha_id}"
 
     try:
-        res = requests.post(url, data=query, headers=req_headers)
+        res = get_geetest_session().post(url, data=query, headers=req_headers,
+                                         timeout=GEETEST_TIMEOUT)
         assert res.status_code == 200
         gt_msg = res.json()
     except Exception as e:
@@ -1361,7 +2880,7 @@ def validate_geetest(validate):
 @app.route('/get-public-key', methods=['GET'])
 @cache_control('no-cache')
 def get_public_key():
-    return public_key_pem, 200
+    return load_rsa_keys()[1], 200
 
 
 @app.route('/login', methods=['POST'])
@@ -1378,10 +2897,22 @@ def login():
         if not validate_geetest(validate):
             return "Invalid captcha", 401
 
-    password = decrypt_password(encrypted_password, private_key_pem)
+    # 客户端可能拿到的是轮换前的公钥，当前密钥解不开时再试上一代
+    password = None
+    for private_key in load_rsa_keys()[0]:
+        try:
+            password = decrypt_password(encrypted_password, private_key)
+            break
+        except ValueError:
+            continue
+    if password is None:
+        return "Invalid credentials", 401
 
     user = User.query.filter_by(username=username).first()
-    if user and user.check_password(password):
+    verified = verify_password(user.password, password) if user else False
+    if verified is None:
+        return "Too many login attempts", 503
+    if verified:
         token = generate_token()
         login_token = UserLoginToken(userid=user.userid, token=token)
         db.session.add(login_token)
@@ -1408,6 +2939,7 @@ def logout():
 
     db.session.delete(login_token)
     db.session.commit()
+    invalidate_token(token)
 
     response = make_response(
         jsonify({"code": 0, 'message': 'Logged out successfully'}))
@@ -1417,16 +2949,14 @@ def logout():
 
 @app.route('/game-events/save-settings', methods=['POST'])
 def save_user_settings():
-    token = request.cookies.get('token')
-    if not token:
-        return "Unauthorized", 401
-
-    login_token = UserLoginToken.query.filter_by(token=token).first()
-    if not login_token:
+    auth = authenticate_token(request.cookies.get('token'))
+    if not auth:
         return "Unauthorized", 401
 
-    userid = login_token.userid
+    userid = auth[0]
     settings = request.json
+    # 直接写库，缓冲中更早的设置作废
+    discard_pending_settings(userid)
 
     user_settings = UserSettings.query.filter_by(userid=userid).first()
     if user_settings:
@@ -1443,15 +2973,14 @@ def save_user_settings():
 @app.route('/game-events/load-settings', methods=['GET'])
 @cache_control('no-cache')
 def load_user_settings():
-    token = request.cookies.get('token')
-    if not token:
+    auth = authenticate_token(request.cookies.get('token'))
+    if not auth:
         return "Unauthorized", 401
 
-    login_token = UserLoginToken.query.filter_by(token=token).first()
-    if not login_token:
-        return "Unauthorized", 401
-
-    userid = login_token.userid
+    userid = auth[0]
+    pending = get_pending_settings(userid)
+    if pending is not None:
+        return jsonify(pending)
     user_settings = UserSettings.query.filter_by(userid=userid).first()
 
     if user_settings:
@@ -1498,9 +3027,22 @@ def game_events():
     return render_template("game-events.html", nowYear=datetime.now().year, captchaId=captcha_id)
 
 
-@app.route('/favicon')
-@cache_control('no-cache')
-def dynamic_favicon():
+def get_favicon_font():
+    """字体只加载一次，加载失败时使用 Pillow 的默认字体"""
+    global favicon_font
+    from PIL import ImageFont
+
+    if favicon_font is None:
+        try:
+            favicon_font = ImageFont.truetype(favicon_font_path, 20)
+        except IOError:
+            favicon_font = ImageFont.load_default()
+    return favicon_font
+
+
+def render_favicon(day):
+    from PIL import Image, ImageDraw
+
     size = (32, 32)
     radius = 8
     image = Image.new('RGBA', size, (255, 255, 255, 0))
@@ -1508,13 +3050,8 @@ def dynamic_favicon():
     rect_color = (50, 150, 255, 255)
     draw.rounded_rectangle([0, 0, size[0], size[1]],
                            radius=radius, fill=rect_color)
-    today = datetime.now().day
-    day_str = str(today)
-
-    try:
-        font = ImageFont.truetype("凤凰点阵体 12px.ttf", 20)
-    except IOError:
-        font = ImageFont.load_default()
+    day_str = str(day)
+    font = get_favicon_font()
 
     text_bbox = draw.textbbox((0, 0), day_str, font=font)
     text_size = (text_bbox[2] - text_bbox[0], text_bbox[3] - text_bbox[1])
@@ -1525,13 +3062,64 @@ def dynamic_favicon():
 
     img_io = io.BytesIO()
     image.save(img_io, 'PNG')
-    img_io.seek(0)
+    return img_io.getvalue()
+
 
-    response = make_response(send_file(img_io, mimetype='image/png'))
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+def get_favicon(day):
+    """返回某一天的 (PNG, ETag)，每个日期只渲染一次，最多 31 个"""
+    with favicon_lock:
+        entry = favicon_cache.get(day)
+        if entry is None:
+            png = render_favicon(day)
+            entry = (png, hashlib.sha1(png).hexdigest()[:16])
+            favicon_cache[day] = entry
+        return entry
+
+
+@app.route('/favicon')
+def dynamic_favicon():
+    now = datetime.now()
+    png, etag = get_favicon(now.day)
+    # 图标只在日期变化时改变，缓存到本地时间的午夜
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    max_age = max(1, int((midnight - now).total_seconds()))
+
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(png)
+        response.headers['Content-Type'] = 'image/png'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    return response
+
+
+@app.route('/game-events/banner/<name>')
+def banner_file(name):
+    if not BANNER_FILE_RE.match(name):
+        return render_template('404.html', nowYear=datetime.now().year), 404
+    response = make_response(send_from_directory(banner_cache_dir, name))
+    # 文件名由内容决定，可以永久缓存
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
     return response
 
 
+@app.route('/game-events/status')
+@cache_control('no-cache')
+def refresh_status():
+    last_update_time = get_last_update_time()
+    return jsonify({
+        "scheduler_leader": get_scheduler_leader(),
+        "pid": os.getpid(),
+        "last_update_time": last_update_time.strftime('%Y-%m-%d %H:%M:%S') if last_update_time else None,
+        "refresh_in_progress": refresh_lock.locked(),
+        "fetch": fetch_stats,
+        "banner_cache": banner_cache_stats,
+        "token_cache": get_token_cache_stats(),
+        "settings_flush": dict(settings_flush_stats, pending=len(pending_settings)),
+    })
+
+
 @app.errorhandler(404)
 @cache_control('max-age=86400')
 def show_404_page(e):
@@ -1562,7 +3150,13 @@ def load_geetest_config():
 geetest_config = load_geetest_config()
 app.config['GEETEST_CONFIG'] = geetest_config
 
+initialize_database()
+start_parse_pool()
+
+acquire_scheduler_lease()
 scheduler = BackgroundScheduler()
+scheduler.add_job(scheduler_heartbeat, 'interval',
+                  seconds=SCHEDULER_HEARTBEAT_SECONDS)
 scheduler.add_job(scheduled_task, 'cron', hour=9, minute=0)
 scheduler.add_job(scheduled_task, 'cron', hour=11, minute=10)
 scheduler.add_job(scheduled_task, 'cron', hour=16, minute=0)
@@ -1572,9 +3166,11 @@ scheduler.start()
 
 
 if __name__ == "__main__":
+    # 只在直接运行时接管信号，gunicorn 的 worker 由 gunicorn 处理信号并正常退出
+    signal.signal(signal.SIGTERM, handle_shutdown_signal)
+    signal.signal(signal.SIGINT, handle_shutdown_signal)
     geetest_config = load_geetest_config()
     with app.app_context():
-        db.create_all()
         initialize_user()
         update_existing_passwords()
     socketio.run(app, host="0.0.0.0", port=8180, allow_unsafe_werkzeug=True)
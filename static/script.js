@@ -5,6 +5,11 @@ window.dateCountdownInterval = null;
 window.totalDays = 0;
 window.pxPerDay = 36;
 window.initialEvents = [];
+window.eventCountdownIntervals = [];
+window.todayHighlightInterval = null;
+window.noticeGeneration = null;
+window.noticeData = null;
+window.noticeSyncing = false;
 window.walkthroughBlackWords = [
     "版本",
     "移涌",//ys
@@ -216,52 +221,70 @@ let eventsSettings = {
     sortOrder: 'default'
 };
 
+function noticeDataToEvents(data) {
+    const events = [];
+    ['ys', 'sr', 'zzz', 'ww'].forEach(type => {
+        if (Array.isArray(data[type])) {
+            data[type].forEach(event => {
+                let name = '';
+                if (type === 'ww' && (event.title.includes("区域系列"))) {
+                    name = event.title;
+                } else if (type === 'zzz' && event.event_type === 'gacha') {
+                    name = event.title;
+                } else {
+                    name = extractTitle(event.title);
+                }
+                const newEvent = {
+                    start: new Date(event.start_time),
+                    end: new Date(event.end_time),
+                    name: name,
+                    title: event.title,
+                    color: getColor(type),
+                    bannerImage: event.bannerLocal || event.bannerImage,
+                    bannerThumb: event.bannerThumb,
+                    uuid: event.uuid,
+                    game: type,
+                    type: event.event_type,
+                };
+                if (newEvent.bannerImage === "") {
+                    if (newEvent.game === "sr") {
+                        newEvent.bannerImage = "/static/images/sr.png";
+                    }
+                }
+                events.push(newEvent);
+            });
+        }
+    });
+    return events;
+}
+
 function loadEvents(socket) {
     fetch('game-events/getnotice')
         .then(response => {
             if (!response.ok) {
                 throw new Error('网络响应不正常');
             }
+            window.noticeGeneration = Number(response.headers.get('X-Notice-Generation'));
             return response.json();
         })
         .then(data => {
-            const events = [];
-            ['ys', 'sr', 'zzz', 'ww'].forEach(type => {
-                if (Array.isArray(data[type])) {
-                    data[type].forEach(event => {
-                        let name = '';
-                        if (type === 'ww' && (event.title.includes("区域系列"))) {
-                            name = event.title;
-                        } else if (type === 'zzz' && event.event_type === 'gacha') {
-                            name = event.title;
-                        } else {
-                            name = extractTitle(event.title);
-                        }
-                        const newEvent = {
-                            start: new Date(event.start_time),
-                            end: new Date(event.end_time),
-                            name: name,
-                            title: event.title,
-                            color: getColor(type),
-                            bannerImage: event.bannerImage,
-                            uuid: event.uuid,
-                            game: type,
-                            type: event.event_type,
-                        };
-                        if (newEvent.bannerImage === "") {
-                            if (newEvent.game === "sr") {
-                                newEvent.bannerImage = "/static/images/sr.png";
-                            }
-                        }
-                        events.push(newEvent);
-                    });
-                }
-            });
+            window.noticeData = data;
+            const events = noticeDataToEvents(data);
             if (events.length > 0) {
                 updateCurrentTimeMarker();
                 createTimeline(events);
                 setInterval(updateCurrentTimeMarker, 100);
                 createLegend();
+                // 页面重新可见和定时检查时只拉取变化的活动
+                document.addEventListener('visibilitychange', () => {
+                    if (document.visibilityState === 'visible') {
+                        syncEvents();
+                    }
+                });
+                // 已登录的页面通过 events_updated 推送获得更新，不需要轮询
+                if (!socket) {
+                    setInterval(syncEvents, 30 * 60 * 1000);
+                }
                 const savedSettings = localStorage.getItem('events_setting');
                 if (savedSettings) {
                     eventsSettings = JSON.parse(savedSettings);
@@ -435,6 +458,18 @@ function connectWebSocket(token) {
         sortSelect.value = eventsSettings.sortOrder;
         sortEvents();
     });
+    socket.on('events_updated', (delta) => {
+        if (!window.noticeData || delta.generation <= window.noticeGeneration) {
+            return;
+        }
+        if (delta.generation === window.noticeGeneration + 1) {
+            applyNoticeDelta(delta);
+            window.noticeGeneration = delta.generation;
+            renderTimeline();
+        } else {
+            syncEvents();
+        }
+    });
     socket.on('disconnect', () => {
         // console.log('Disconnected from server');
     });
@@ -491,10 +526,90 @@ function updateSettings(settings, socket) {
     socket.emit('settings_updated', { settings });
 }
 
+function syncEvents() {
+    if (!Number.isInteger(window.noticeGeneration) || window.noticeSyncing) {
+        return;
+    }
+    window.noticeSyncing = true;
+    fetch(`game-events/getnotice?since=${window.noticeGeneration}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('网络响应不正常');
+            }
+            return response.json();
+        })
+        .then(delta => {
+            if (delta.full) {
+                return reloadEvents();
+            }
+            if (delta.generation === window.noticeGeneration) {
+                return;
+            }
+            applyNoticeDelta(delta);
+            window.noticeGeneration = delta.generation;
+            renderTimeline();
+        })
+        .catch(error => console.error('同步事件出错:', error))
+        .finally(() => {
+            window.noticeSyncing = false;
+        });
+}
+
+function reloadEvents() {
+    return fetch('game-events/getnotice')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('网络响应不正常');
+            }
+            window.noticeGeneration = Number(response.headers.get('X-Notice-Generation'));
+            return response.json();
+        })
+        .then(data => {
+            window.noticeData = data;
+            renderTimeline();
+        });
+}
+
+function applyNoticeDelta(delta) {
+    // 按 uuid 合并变化的活动，再按服务端给出的顺序重建各游戏的列表
+    const byUuid = {};
+    Object.values(window.noticeData).forEach(gameEvents => {
+        gameEvents.forEach(event => {
+            byUuid[event.uuid] = event;
+        });
+    });
+    delta.removed.forEach(uuid => delete byUuid[uuid]);
+    Object.assign(byUuid, delta.events);
+    const data = {};
+    Object.entries(delta.order).forEach(([game, uuids]) => {
+        data[game] = uuids.map(uuid => byUuid[uuid]).filter(Boolean);
+    });
+    window.noticeData = data;
+}
+
+function renderTimeline() {
+    const events = noticeDataToEvents(window.noticeData);
+    if (events.length === 0) {
+        return;
+    }
+    // 后台重新渲染时保持用户当前的滚动位置，不跳回“现在”
+    const timelineContainer = document.querySelector('.timeline-container');
+    const scrollLeft = timelineContainer.scrollLeft;
+    document.querySelector('.timeline').innerHTML = '';
+    document.querySelector('.date-axis').innerHTML = '';
+    createTimeline(events);
+    loadHiddenStatus();
+    loadCompletionStatus();
+    timelineContainer.scrollLeft = scrollLeft;
+}
+
 function createTimeline(events) {
     const timeline = document.querySelector('.timeline');
     const timeline_container = document.querySelector('.timeline-container');
     const dateAxis = document.querySelector('.date-axis');
+    // 重新渲染时清掉上一次创建的倒计时
+    window.eventCountdownIntervals.forEach(clearInterval);
+    window.eventCountdownIntervals = [];
     const earliestStart = new Date(Math.min(...events.map(event => event.start.getTime())));
     const latestEnd = new Date(Math.max(...events.map(event => event.end.getTime())));
     const timelineStart = new Date(earliestStart);
@@ -658,7 +773,7 @@ function createTimeline(events) {
         }
         // 初始化倒计时
         updateEventCountdown();
-        setInterval(updateEventCountdown, 1000);
+        window.eventCountdownIntervals.push(setInterval(updateEventCountdown, 1000));
         eventElement.addEventListener('click', function () {
             document.querySelectorAll('.event').forEach(e => {
                 if (e.style.outlineWidth === "3px") {
@@ -684,7 +799,8 @@ function createTimeline(events) {
         // 创建并添加带有 bannerImage 的 div
         const bannerDiv = document.createElement('div');
         bannerDiv.classList.add('event-banner');
-        bannerDiv.style.backgroundImage = `url(${event.bannerImage})`;
+        // 时间轴上优先使用服务端缓存的缩略图
+        bannerDiv.style.backgroundImage = `url(${event.bannerThumb || event.bannerImage})`;
         if (event.type === "gacha") {
             if (event.game === "ys") {
                 bannerDiv.style.backgroundPosition = 'center 45px';
@@ -718,10 +834,16 @@ function createTimeline(events) {
         timeline_container.scrollLeft = currentOffset * totalDays * pxPerDay - timeline_container.offsetWidth / 2 + 20;
     });
 
-    const linestylediv = document.createElement("style");
+    let linestylediv = document.getElementById('date-label-line-style');
+    if (!linestylediv) {
+        linestylediv = document.createElement("style");
+        linestylediv.id = 'date-label-line-style';
+        document.body.appendChild(linestylediv);
+    }
     linestylediv.innerHTML = `.date-label-line {height:${(timeline.children.length) * 40 - 15}px!important;}`;
-    document.body.appendChild(linestylediv);
-    setInterval(updateTodayHighlight, 500);
+    if (!window.todayHighlightInterval) {
+        window.todayHighlightInterval = setInterval(updateTodayHighlight, 500);
+    }
     initialEvents = [...document.querySelectorAll('.event')];
     sortEvents();
     updateCurrentTimeMarker();